@@ -0,0 +1,109 @@
+"Ages of the texts shown in the treeview, from recorded modification times."
+
+from icecream import ic
+
+import os
+import time
+
+import constants
+
+
+def format_age(seconds):
+    "Return the age in the given number of seconds as a string, in suitable units."
+    seconds = max(0.0, seconds)
+    days = int(seconds // 86400)
+    if days >= 365.25:
+        value = days / 365.25
+        unit = "yrs"
+    elif days >= 30.5:
+        value = days / 30.5
+        unit = "mths"
+    elif days >= 1:
+        value = seconds / 86400.0
+        unit = "days"
+    elif seconds >= 3600.0:
+        value = seconds / 3600.0
+        unit = "hrs"
+    elif seconds >= 60.0:
+        value = seconds / 60.0
+        unit = "mins"
+    else:
+        value = seconds
+        unit = "secs"
+    return f"{value:.0f} {unit}"
+
+
+def get_delay(seconds):
+    """Return the delay in milliseconds before the next update, when the
+    youngest of the texts has the given age. An old age changes only
+    in its number of days or months, so it need not be updated often.
+    """
+    for age, delay in constants.AGES_UPDATE_DELAYS:
+        if seconds < age:
+            return delay
+    return constants.AGES_UPDATE_DELAY_MAX
+
+
+class Ages:
+    """Cache of the ages currently displayed for the texts. The modification
+    time of a text is that recorded when its file was last read, which is
+    done also when it is saved or refreshed. The files of a directory are
+    stat'ed only if the modification time of the directory has changed since
+    it was listed, which is when files have been added, removed or replaced.
+    """
+
+    def __init__(self):
+        # Key: absolute directory path; value: modification time when scanned.
+        self.dirmtimes = {}
+        self.mtimes = {}  # Key: absolute file path; value: modification time.
+        self.displayed = {}  # Key: text id; value: age string.
+
+    def scan(self, texts):
+        """Update the modification times of the files for the texts, in the
+        directories that have been modified since last listed or scanned.
+        """
+        sections = dict([(t.parent.abspath, t.parent) for t in texts])
+        for dirpath, section in sections.items():
+            try:
+                dirmtime = os.stat(dirpath).st_mtime_ns
+                if dirmtime == self.dirmtimes.get(dirpath, section.mtime):
+                    continue
+                self.dirmtimes[dirpath] = dirmtime
+                with os.scandir(dirpath) as scanner:
+                    for entry in scanner:
+                        if entry.name.endswith(constants.MARKDOWN_EXT):
+                            self.mtimes[entry.path] = entry.stat().st_mtime
+            except OSError:  # Removed or moved; caught by refresh.
+                pass
+
+    def get_mtime(self, text):
+        "Return the latest known modification time of the file for the text."
+        mtime = text.stat[0] / 1e9
+        return max(mtime, self.mtimes.get(text.abspath, mtime))
+
+    def get(self, text, now=None):
+        "Return the age of the text as a string, and record it as displayed."
+        result = format_age((now or time.time()) - self.get_mtime(text))
+        self.displayed[text.id] = result
+        return result
+
+    def update(self, texts):
+        """Rescan the modification times of the files for the texts, and return
+        the list of (text, age) for those with an age that differs from the one
+        displayed, and the delay in milliseconds before the next update.
+        """
+        self.scan(texts)
+        now = time.time()
+        youngest = None
+        changed = []
+        for text in texts:
+            previous = self.displayed.get(text.id)
+            age = self.get(text, now=now)
+            if age != previous:
+                changed.append((text, age))
+            seconds = now - self.get_mtime(text)
+            if youngest is None or seconds < youngest:
+                youngest = seconds
+        if youngest is None:
+            return changed, constants.AGES_UPDATE_DELAY_MAX
+        return changed, get_delay(youngest)
@@ -12,10 +12,37 @@ AU64 = "iVBORw0KGgoAAAANSUhEUgAAAEAAAABACAYAAACqaXHeAAABhGlDQ1BJQ0MgcHJvZmlsZQAA
 DEFAULT_ROOT_GEOMETRY = "1500x400+700+0"
 DEFAULT_LANGUAGES = ("sv-SE", "en-GB", "en-US")
 
+# Milliseconds between updates of the ages in the treeview, depending on
+# the age in seconds of the youngest text shown there.
 AGES_UPDATE_DELAY = 2000
+AGES_UPDATE_DELAYS = ((60, AGES_UPDATE_DELAY), (3600, 30_000), (86400, 300_000))
+AGES_UPDATE_DELAY_MAX = 3_600_000
+
+# Seconds between polls of the files by the watcher thread, and milliseconds
+# between checks in the Tk main loop for changes reported by it.
+WATCH_INTERVAL = 2.0
+WATCH_CHECK_DELAY = 500
+
+# Fewer changed texts than this are parsed serially when loading a source.
+PARSE_PARALLEL_MINIMUM = 50
+
+# Milliseconds after the main window has been shown before parsing the texts
+# not in the cache, when their summaries are required for the meta viewers.
+SUMMARIES_DELAY = 100
+
+# At most this many texts, with at most this many characters in total, are
+# kept displayed in the texts notebook; those least recently shown are evicted.
+# Overridden by 'viewers_max' and 'viewers_max_chars' in the main config.
+VIEWERS_MAX = 50
+VIEWERS_MAX_CHARS = 1_000_000
+
+# Maximum number of segments of characters inserted in one call to Tk.
+RENDER_BATCH_SIZE = 1000
 
 MARKDOWN_EXT = ".md"
 CONFIG_FILENAME = "config.json"
+CACHE_FILENAME = "cache.pickle"
+SEARCH_INDEX_FILENAME = "search_index.pickle"
 ARCHIVE_DIRNAME = "au_archive"
 assert os.extsep not in ARCHIVE_DIRNAME
 REFERENCES_DIRNAME = "au_references"
@@ -173,6 +200,9 @@ CODE_INDENT = 30
 LIST_PREFIX = "list-"
 LIST_ITEM_PREFIX = "list_item-"
 LIST_BULLET_PREFIX = "list_bullet-"
+# Tags shared by the list items and bullets at the same level in viewers.
+LIST_ITEM_LEVEL_PREFIX = "list_item_level-"
+LIST_BULLET_LEVEL_PREFIX = "list_bullet_level-"
 LIST_INDENT = 16
 LIST_COLOR = "lightcyan"
 
@@ -229,9 +259,16 @@ HIGHLIGHT = "highlight"
 HIGHLIGHT_COLOR = "yellow"
 
 SEARCH = "search"
-SEARCH_PREFIX = "search-"
+SEARCH_MORE = "search_more"
+SEARCH_PAGE_SIZE = 100
 SEARCH_FRAGMENT = 24
 SEARCH_INDENT = 10
+# Milliseconds after the last keystroke before searching for the typed term,
+# which must have at least this many characters, and milliseconds between
+# checks in the Tk main loop for results from the search thread.
+SEARCH_TYPED_DELAY = 300
+SEARCH_TYPED_MINIMUM = 3
+SEARCH_CHECK_DELAY = 50
 
 WRITE_CURSOR = "watch"
 
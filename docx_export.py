@@ -16,6 +16,7 @@ import docx.oxml
 import constants
 import utils
 from utils import Tr
+from visitor import Visitor
 
 CODE_STYLE = "Au Code"
 CODE_LEFT_INDENT = 30
@@ -34,7 +35,7 @@ FOOTNOTES_DISPLAY = (
 )
 
 
-class Exporter:
+class Exporter(Visitor):
     "DOCX exporter."
 
     def __init__(self, main, source, config):
@@ -368,18 +369,9 @@ class Exporter:
                 if entry is not entries[-1]:
                     paragraph.add_run(", ")
 
-    def render(self, ast):
-        try:
-            method = getattr(self, f"render_{ast['element']}")
-        except AttributeError:
-            ic("Could not handle ast", ast)
-        else:
-            method(ast)
-
     def render_document(self, ast):
         self.prev_blank_line = False
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
 
     def render_paragraph(self, ast):
         if self.footnote_paragraph:
@@ -409,8 +401,7 @@ class Exporter:
             self.paragraph.style = style
         else:
             self.paragraph.style = self.style_stack[-1]
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
 
     def render_raw_text(self, ast):
         line = ast["children"]
@@ -426,8 +417,7 @@ class Exporter:
 
     def render_quote(self, ast):
         self.style_stack.append(QUOTE_STYLE)
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.style_stack.pop()
 
     def render_code_span(self, ast):
@@ -437,27 +427,23 @@ class Exporter:
     def render_code_block(self, ast):
         self.paragraph = self.document.add_paragraph(style=CODE_STYLE)
         self.style_stack.append(CODE_STYLE)
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.style_stack.pop()
 
     def render_fenced_code(self, ast):
         self.paragraph = self.document.add_paragraph(style=CODE_STYLE)
         self.style_stack.append(CODE_STYLE)
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.style_stack.pop()
 
     def render_emphasis(self, ast):
         self.italic = True
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.italic = False
 
     def render_strong_emphasis(self, ast):
         self.bold = True
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.bold = False
 
     def render_thematic_break(self, ast):
@@ -482,16 +468,14 @@ class Exporter:
             depth=len(self.list_stack) + 1,
         )
         self.list_stack.append(data)
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.list_stack.pop()
 
     def render_list_item(self, ast):
         data = self.list_stack[-1]
         data["count"] += 1  # Currently useless.
         data["first_paragraph"] = True
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
 
     def render_indexed(self, ast):
         entries = self.indexed.setdefault(ast["canonical"], [])
@@ -23,10 +23,15 @@ from text_viewer import TextViewer
 class Editor(TextViewer):
     "Base text editor class."
 
+    # The tags of elements move along with the edits, so each element
+    # has a tag of its own.
+    POOLED_TAGS = False
+
     def __init__(self, main, text):
         self.toplevel_create(main, text)
         super().__init__(self.toplevel, main, text)
         self.menubar_create()
+        self.changed_on_disk = False
 
     def toplevel_create(self, main, text):
         self.toplevel = tk.Toplevel(main.root)
@@ -816,6 +821,12 @@ class Editor(TextViewer):
         """
         if not self.modified:
             return
+        if self.changed_on_disk and not tk.messagebox.askokcancel(
+            parent=self.toplevel,
+            title=Tr("Save?"),
+            message=f"{Tr('The file has been changed by another program')}. {Tr('Really overwrite?')}",
+        ):
+            return
         self.save_prepare()
         for item in self.view.dump("1.0", tk.END):
             try:
@@ -828,8 +839,17 @@ class Editor(TextViewer):
         self.text.write(self.outfile.getvalue())
         self.menubar.configure(background=self.original_menubar_background)
         self.modified = False
+        self.changed_on_disk = False
+        self.toplevel.title(f"{Tr('Edit')}: {self.text.fullname}")
         self.save_finalize()
 
+    def file_changed(self):
+        "The file has been changed by another program while being edited."
+        self.changed_on_disk = True
+        self.toplevel.title(
+            f"{Tr('Edit')}: {self.text.fullname} ({Tr('changed on disk')})"
+        )
+
     def save_prepare(self):
         "Prepare for saving; before doing dump-to-Markdown."
         self.outfile_stack = [io.StringIO()]
@@ -16,9 +16,10 @@ from ebooklib import epub
 import utils
 import constants
 from utils import Tr
+from visitor import Visitor
 
 
-class Exporter:
+class Exporter(Visitor):
     "HTML exporter."
 
     def __init__(self, main, source, config):
@@ -270,22 +271,12 @@ class Exporter:
             self.output_newline("")
             self.output_newline("</p>")
 
-    def render(self, ast):
-        try:
-            method = getattr(self, f"render_{ast['element']}")
-        except AttributeError:
-            ic("Could not handle ast", ast)
-        else:
-            method(ast)
-
     def render_document(self, ast):
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
 
     def render_paragraph(self, ast):
         self.output_newline("<p>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output_newline("</p>")
 
     def render_raw_text(self, ast):
@@ -296,8 +287,7 @@ class Exporter:
 
     def render_quote(self, ast):
         self.output_newline("<blockquote>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output_newline("</blockquote>")
 
     def render_code_span(self, ast):
@@ -305,26 +295,22 @@ class Exporter:
 
     def render_code_block(self, ast):
         self.output("<pre><code>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output_newline("</code></pre>")
 
     def render_fenced_code(self, ast):
         self.output("<pre><code>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output_newline("</code></pre>")
 
     def render_emphasis(self, ast):
         self.output("<em>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output("</em>")
 
     def render_strong_emphasis(self, ast):
         self.output("<strong>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output("</strong>")
 
     def render_thematic_break(self, ast):
@@ -332,8 +318,7 @@ class Exporter:
 
     def render_link(self, ast):
         self.output(f'<a href="{ast["dest"]}">')
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output("</a>")
 
     def render_list(self, ast):
@@ -341,8 +326,7 @@ class Exporter:
             self.output_newline("<ol>")
         else:
             self.output_newline("<ul>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         if ast["ordered"]:
             self.output_newline("</ol>")
         else:
@@ -350,8 +334,7 @@ class Exporter:
 
     def render_list_item(self, ast):
         self.output_newline("<li>")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.output_newline("</li>")
 
     def render_indexed(self, ast):
@@ -0,0 +1,198 @@
+"""Encoding and decoding of the YAML frontmatter of Markdown files.
+
+The frontmatter written by Au is a flat mapping of simple values and lists.
+Such content is handled by a hand-written fast path. Anything else is passed
+on to PyYAML, using the libyaml-based loader when available.
+
+The output must be identical to that of 'yaml.dump', which is what Au has
+always written. The libyaml emitter wraps long quoted strings differently,
+so the pure-Python emitter is used whenever the fast path does not apply.
+"""
+
+from icecream import ic
+
+import re
+
+import yaml
+
+try:
+    SafeLoader = yaml.CSafeLoader
+except AttributeError:
+    SafeLoader = yaml.SafeLoader
+
+# The column beyond which 'yaml.dump' may wrap a plain scalar.
+WIDTH = 80
+
+# Plain scalars that YAML 1.1 resolves to booleans or null.
+SPECIAL_WORDS = frozenset(
+    """yes Yes YES no No NO true True TRUE false False FALSE on On ON off Off OFF
+    null Null NULL""".split()
+)
+
+KEY_NAME_RX = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+KEY_RX = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*):(?: (.+))?$")
+INTEGER_RX = re.compile(r"^-?(0|[1-9][0-9]*)$")
+# A plain string that YAML cannot resolve as anything else, nor need to quote.
+STRING_RX = re.compile(r"^[A-Za-z][\x20-\x7e]*$")
+PRINTABLE_RX = re.compile(r"^[\x20-\x7e]*$")
+
+# Resolves the type of a plain scalar, like the loader and dumper do.
+RESOLVER = yaml.resolver.Resolver()
+STR_TAG = "tag:yaml.org,2002:str"
+
+# Marker for a value that the fast path cannot handle.
+FAIL = object()
+
+
+def load(text):
+    "Return the frontmatter as a dictionary from the YAML text."
+    result = fast_load(text)
+    if result is FAIL:
+        result = yaml.load(text, Loader=SafeLoader)
+    return result
+
+
+def dump(frontmatter):
+    "Return the YAML text for the frontmatter dictionary."
+    result = fast_dump(frontmatter)
+    if result is FAIL:
+        result = yaml.dump(frontmatter)
+    return result
+
+
+def fast_load(text):
+    "Parse a flat mapping of simple values and lists; else return FAIL."
+    result = {}
+    key = None  # The key of the list currently being read, if any.
+    for line in text.split("\n"):
+        if not line:
+            continue
+        if line.startswith("- "):
+            if key is None:
+                return FAIL
+            value = load_scalar(line[2:])
+            if value is FAIL:
+                return FAIL
+            result[key].append(value)
+            continue
+        if key is not None and not result[key]:  # Key without value.
+            result[key] = None
+        match = KEY_RX.match(line)
+        if not match:
+            return FAIL
+        if match.group(1) in SPECIAL_WORDS or match.group(1) in result:
+            return FAIL
+        if match.group(2) is None:
+            key = match.group(1)
+            result[key] = []
+        else:
+            key = None
+            value = load_scalar(match.group(2))
+            if value is FAIL:
+                return FAIL
+            result[match.group(1)] = value
+    if key is not None and not result[key]:
+        result[key] = None
+    if not result:
+        return FAIL
+    return result
+
+
+def load_scalar(value):
+    "Return the value of a simple scalar; else FAIL."
+    if value == "true":
+        return True
+    elif value == "false":
+        return False
+    elif value == "null":
+        return None
+    elif value == "[]":
+        return []
+    elif INTEGER_RX.match(value):
+        return int(value)
+    elif is_plain(value):
+        return value
+    elif len(value) >= 2 and value[0] == "'" and value[-1] == "'":
+        value = value[1:-1]
+        # A single quote within the string must be doubled.
+        if "'" in value.replace("''", "") or not PRINTABLE_RX.match(value):
+            return FAIL
+        return value.replace("''", "'")
+    else:
+        return FAIL
+
+
+def fast_dump(frontmatter):
+    "Output a flat mapping of simple values and lists; else return FAIL."
+    if not isinstance(frontmatter, dict) or not frontmatter:
+        return FAIL
+    lines = []
+    try:
+        keys = sorted(frontmatter)
+    except TypeError:
+        return FAIL
+    for key in keys:
+        if not (isinstance(key, str) and KEY_NAME_RX.fullmatch(key)):
+            return FAIL
+        if key in SPECIAL_WORDS or len(key) > WIDTH:
+            return FAIL
+        value = frontmatter[key]
+        if isinstance(value, list) and value:
+            lines.append(f"{key}:")
+            for item in value:
+                item = dump_scalar(item, width=WIDTH - 2)
+                if item is FAIL:
+                    return FAIL
+                lines.append(f"- {item}")
+        else:
+            value = dump_scalar(value, width=WIDTH - len(key) - 2)
+            if value is FAIL:
+                return FAIL
+            lines.append(f"{key}: {value}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def dump_scalar(value, width):
+    "Return the output for a simple value that fits the width; else FAIL."
+    if value is True:
+        return "true"
+    elif value is False:
+        return "false"
+    elif value is None:
+        return "null"
+    elif type(value) is int:
+        return str(value)
+    elif type(value) is list and not value:
+        return "[]"
+    elif type(value) is str:
+        if is_plain(value):
+            result = value
+        elif is_quoted(value):
+            result = "'" + value.replace("'", "''") + "'"
+        else:
+            return FAIL
+        # Longer strings may be wrapped by 'yaml.dump'.
+        if len(result) <= width:
+            return result
+    return FAIL
+
+
+def is_plain(value):
+    "Is the string output as a plain scalar, which cannot be read as non-string?"
+    return (
+        bool(STRING_RX.match(value))
+        and value not in SPECIAL_WORDS
+        and value[-1] not in " :"
+        and ": " not in value
+        and " #" not in value
+    )
+
+
+def is_quoted(value):
+    """Is the string output in single quotes, since it would otherwise
+    be read as non-string?
+    """
+    return bool(PRINTABLE_RX.match(value)) and (
+        RESOLVER.resolve(yaml.ScalarNode, value, (True, False)) != STR_TAG
+    )
@@ -34,12 +34,12 @@ class IndexedViewer(Viewer):
     def display_initialize(self):
         super().display_initialize()
         self.indexed = {}  # Key: term; value: position in this view.
-        # Gather positions of indexed terms in source texts.
-        pos = {}
+        # Gather number of occurrences of indexed terms in source texts.
+        counts = {}
         for text in self.main.source.all_texts:
-            for term, positions in text.viewer.indexed.items():
-                pos.setdefault(term, {})[text.fullname] = list(sorted(positions))
-        self.terms = sorted(pos.items(), key=lambda i: i[0].lower())
+            for term, count in text.indexed.items():
+                counts.setdefault(term, {})[text.fullname] = count
+        self.terms = sorted(counts.items(), key=lambda i: i[0].lower())
 
     def display_heading(self):
         pass
@@ -48,14 +48,13 @@ class IndexedViewer(Viewer):
         for term, fullnames in self.terms:
             self.indexed[term] = self.view.index(tk.INSERT)
             self.view.insert(tk.INSERT, term, constants.INDEXED)
-            for fullname, positions in sorted(fullnames.items()):
+            for fullname, count in sorted(fullnames.items()):
                 self.view.insert(tk.INSERT, "\n")
-                positions = sorted(positions, key=lambda p: int(p[: p.index(".")]))
-                self.xref_create(fullname, positions[0], constants.INDEXED)
-                for i, position in enumerate(positions[1:], start=2):
+                self.xref_create(fullname, term, 1, constants.INDEXED)
+                for number in range(2, count + 1):
                     self.view.insert(tk.INSERT, ", ")
                     self.xref_create(
-                        fullname, position, constants.INDEXED, label=str(i)
+                        fullname, term, number, constants.INDEXED, label=str(number)
                     )
             self.view.insert(tk.INSERT, "\n")
 
@@ -2,6 +2,7 @@
 
 from icecream import ic
 
+import collections
 import functools
 import json
 import os
@@ -22,7 +23,10 @@ import epub_export
 import html_export
 
 from utils import Tr
+from ages import Ages
 from source import Source
+from search_index import SearchIndex, get_fragment
+from watcher import Watcher
 from text_viewer import TextViewer
 from text_editor import TextEditor
 from title_viewer import TitleViewer
@@ -52,9 +56,13 @@ class Main:
         if not os.path.exists(referencesdirpath):
             os.mkdir(referencesdirpath)
 
-        self.help_source = Source(os.path.join(os.path.dirname(__file__), "help"))
-        self.source = Source(self.absdirpath)
+        self.help_source = Source(
+            os.path.join(os.path.dirname(__file__), "help"), cache=False
+        )
         self.config_read()
+        self.source = Source(
+            self.absdirpath, workers=self.config["main"].get("parse_workers")
+        )
 
         self.root = tk.Tk()
         font_families = set(tk.font.families())
@@ -72,6 +80,7 @@ class Main:
         self.root.protocol("WM_DELETE_WINDOW", self.quit)
         self.root.bind("<Control-q>", self.quit)
         self.root.bind("<Control-Q>", self.quit)
+        self.root.bind("<F5>", self.refresh)
 
         self.title = self.config["main"].get("title", str(self.source))
         self.subtitle = self.config["main"].get("subtitle", "")
@@ -85,8 +94,12 @@ class Main:
         self.clipboard = []
         self.clipboard_chars = ""
         self.source.apply_config(self.config["source"])
-        self.text_editors = {}  # Key: fullname; value: TextEditor instance
-        self.reference_editors = {}  # Key: fullname; value: ReferenceEditor instance
+        self.text_editors = {}  # Key: item id; value: TextEditor instance
+        self.ages = Ages()
+        self.ages_after = None
+        # Key: text id; value: text; in order of most recently shown.
+        self.texts_displayed = collections.OrderedDict()
+        self.reference_editors = {}  # Key: item id; value: ReferenceEditor instance
         self.panedwindow = tk.ttk.PanedWindow(self.root, orient=tk.HORIZONTAL)
         self.panedwindow.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.menubar_setup()
@@ -94,15 +107,23 @@ class Main:
         self.texts_notebook_create()
         self.meta_notebook_create()
 
+        self.summaries_displayed = False
         self.treeview_display()
         self.texts_notebook_display()
-        self.title_viewer.display()
-        self.references_viewer.display()
-        self.indexed_viewer.display()
         self.search_viewer.display()
         self.help_viewer.display()
+        # The summaries of all texts are required for the meta viewers. If some
+        # texts are not in the cache, parse them after the window has been shown.
+        if self.interactive and not self.source.summarized:
+            self.root.after(constants.SUMMARIES_DELAY, self.summaries_display)
+        else:
+            self.summaries_display()
 
+        self.watcher = None
         if self.interactive:
+            if self.config["main"].get("watch_files"):
+                self.watcher_start()
+
             # Set the sizes of the panes.
             self.root.update_idletasks()  # Required for this to work, for some reason.
             try:
@@ -113,6 +134,19 @@ class Main:
                 self.panedwindow.sashpos(0, panes[0])
                 self.panedwindow.sashpos(1, panes[1])
 
+    def summaries_display(self):
+        """Parse the texts not in the cache, in parallel, and display the
+        information that depends on the summaries of all texts.
+        """
+        self.source.preload()
+        self.summaries_displayed = True
+        for text in self.source.all_texts:
+            if self.treeview.exists(text.id):
+                self.treeview.set(text.id, "chars", text.length)
+        self.title_viewer.display()
+        self.references_viewer.display()
+        self.indexed_viewer.display()
+
     @property
     def configpath(self):
         return os.path.join(self.absdirpath, constants.CONFIG_FILENAME)
@@ -128,13 +162,7 @@ class Main:
 
     def config_read(self):
         "Read the configuration file."
-        try:
-            with open(self.configpath) as infile:
-                self.config = json.load(infile)
-            if "main" not in self.config:
-                raise ValueError  # Invalid JSON content.
-        except (OSError, json.JSONDecodeError, ValueError):
-            self.config = dict(main={}, meta={}, source={}, export={})
+        self.config = read_config(self.absdirpath)
 
     def config_save(self):
         "Save the current config. Get current state from the respective widgets."
@@ -147,7 +175,12 @@ class Main:
             geometry=self.root.geometry(),
             panes=[self.panedwindow.sashpos(0), self.panedwindow.sashpos(1)],
             display_heading_ordinal=self.source.display_heading_ordinal,
+            watch_files=self.watcher is not None,
         )
+        # These settings are not available in the menus; keep any given.
+        for key in ("parse_workers", "viewers_max", "viewers_max_chars"):
+            if self.config["main"].get(key):
+                config["main"][key] = self.config["main"][key]
 
         config["meta"] = dict(
             selected=str(self.meta_notebook_lookup[self.meta_notebook.select()])
@@ -157,7 +190,7 @@ class Main:
         # Currently selected text, and cursor locations in all viewers.
         config["source"]["selected"] = self.treeview.focus()
         config["source"]["cursor"] = dict(
-            [(t.fullname, t.viewer.cursor) for t in self.source.all_texts]
+            [(t.id, t.viewer.cursor) for t in self.source.all_texts]
         )
 
         config["export"] = self.config.get("export", {})
@@ -166,6 +199,10 @@ class Main:
             json.dump(config, outfile, indent=2)
         self.config = config
 
+        # Texts may have been re-read during the session.
+        self.source.save_cache()
+        self.references_viewer.source.save_cache()
+
     def menubar_setup(self):
         self.menubar = tk.Menu(self.root, background="gold")
         self.root["menu"] = self.menubar
@@ -174,6 +211,9 @@ class Main:
         self.menu_file = tk.Menu(self.menubar)
         self.menubar.add_cascade(menu=self.menu_file, label=Tr("File"))
         self.menu_file.add_command(label=Tr("Archive"), command=self.archive)
+        self.menu_file.add_command(
+            label=Tr("Refresh"), command=self.refresh, accelerator="F5"
+        )
         self.menu_file.add_command(
             label=Tr("Quit"), command=self.quit, accelerator="Ctrl-Q"
         )
@@ -249,6 +289,15 @@ class Main:
             offvalue=False,
             command=self.set_display_heading_ordinal,
         )
+        self.watch_files_var = tk.IntVar()
+        self.watch_files_var.set(int(bool(self.config["main"].get("watch_files"))))
+        self.menu_settings.add_checkbutton(
+            label=Tr("Watch files"),
+            variable=self.watch_files_var,
+            onvalue=True,
+            offvalue=False,
+            command=self.set_watch_files,
+        )
 
     def set_menubar_state(self):
         """To avoid potential problems, some menu items are restricted
@@ -317,29 +366,92 @@ class Main:
     def treeview_display(self):
         for child in self.treeview.get_children():
             self.treeview.delete(child)
-        for item in self.source.all_items:
-            self.add_treeview_entry(item)
+        self.treeview_populate(self.source)
         self.treeview_update_ages()
 
+    def treeview_populate(self, section):
+        """Insert the rows for the items in the section, replacing its placeholder.
+        The items in closed subsections are inserted only when these are opened.
+        """
+        if section is not self.source:
+            self.treeview.delete(*self.treeview.get_children(section.id))
+        for item in section.items:
+            self.treeview_insert(item)
+
+    def treeview_populated(self, section):
+        "Are the rows for the items in the section present in the treeview?"
+        if section is self.source:
+            return True
+        return section.open and self.treeview.exists(section.id)
+
+    def treeview_add_placeholder(self, section):
+        "Add a placeholder row to the closed section, to allow opening it."
+        if not self.treeview.exists(section.id):
+            return
+        if section.items and not self.treeview.get_children(section.id):
+            self.treeview.insert(section.id, tk.END)
+
     def add_treeview_entry(self, item, index=None):
+        """Insert the row for the item. If its parent section is closed,
+        the row is inserted only when the parent is opened.
+        """
+        if not self.treeview_populated(item.parent):
+            self.treeview_add_placeholder(item.parent)
+            return
+        if self.treeview.exists(item.id):  # Inserted along with its section.
+            return
+        if index is None:
+            index = tk.END
+        self.treeview_insert(item, index)
+
+    def treeview_insert(self, item, index=tk.END):
+        """Insert the row for the item. For a section, also insert the rows
+        for its items if it is open, or else a placeholder if it has any.
+        """
         if item.is_text:
-            self.treeview.insert(
-                item.parentpath, index or tk.END, iid=item.fullname, text=item.heading
-            )
+            self.treeview.insert(item.parent.id, index, iid=item.id, text=item.heading)
+            self.treeview_update_info(item)
         elif item.is_section:
             self.treeview.insert(
-                item.parentpath,
-                index or tk.END,
-                iid=item.fullname,
+                item.parent.id,
+                index,
+                iid=item.id,
                 text=item.heading,
                 open=item.open,
                 tags=(constants.SECTION,),
             )
+            if item.open:
+                for subitem in item.items:
+                    self.treeview_insert(subitem)
+            elif item.items:
+                self.treeview.insert(item.id, tk.END)  # Placeholder.
+
+    def treeview_reveal(self, item):
+        """Open the closed sections containing the item, so that its row
+        is present in the treeview and its tab is shown in the notebook.
+        """
+        outermost = None
+        parent = item.parent
+        while parent is not self.source:
+            if not parent.open:
+                outermost = parent
+            parent = parent.parent
+        if outermost is None:
+            return
+        parent = item.parent
+        while parent is not outermost.parent:
+            parent.open = True
+            parent = parent.parent
+        self.treeview.item(outermost.id, open=True)
+        self.treeview_populate(outermost)
+        self.texts_notebook_set_state(
+            [t for t in outermost.all_texts if t.is_shown], tk.NORMAL
+        )
 
     def treeview_selected(self, event):
         "Synchronize text tab with selected in the treeview."
         try:
-            item = self.source[self.treeview.focus()]
+            item = self.source.ids[self.treeview.focus()]
         except KeyError:
             pass
         else:
@@ -347,46 +459,108 @@ class Main:
                 self.texts_notebook.select(item.tabid)
 
     def treeview_open(self, event=None):
-        fullname = self.treeview.focus()
-        item = self.source[fullname]
+        "Insert the rows for the items in the opened section, and show their tabs."
+        item = self.source.ids[self.treeview.focus()]
         assert item.is_section
         item.open = True
-        for item in item.all_items:
-            if item.is_text:
-                self.texts_notebook.add(item.tabid)
-            elif item.is_section:
-                item.open = True
+        for subitem in item.all_items:
+            if subitem.is_section:
+                subitem.open = True
+        self.treeview_populate(item)
+        self.texts_notebook_set_state(item.all_texts, tk.NORMAL)
 
     def treeview_close(self, event=None):
-        fullname = self.treeview.focus()
-        item = self.source[fullname]
+        "Remove the rows for the items in the closed section, leaving a placeholder."
+        item = self.source.ids[self.treeview.focus()]
         assert item.is_section
         item.open = False
-        for text in item.all_texts:
-            self.texts_notebook.hide(text.tabid)
+        self.treeview.delete(*self.treeview.get_children(item.id))
+        self.treeview_add_placeholder(item)
+        self.texts_notebook_set_state(item.all_texts, tk.HIDDEN)
 
     def treeview_update_info(self, text, modified=None):
+        if not self.treeview.exists(text.id):  # Parent section is closed.
+            return
         if modified is None:
             try:
-                modified = self.text_editors[text.fullname].modified
+                modified = self.text_editors[text.id].modified
             except KeyError:
                 modified = False
-        tags = set(self.treeview.item(text.fullname, "tags"))
+        tags = set(self.treeview.item(text.id, "tags"))
         tags = set()
         if modified:
             tags.add("modified")
         else:
             tags.discard("modified")
-        self.treeview.item(text.fullname, tags=tuple(tags))
-        self.treeview.set(text.fullname, "status", Tr(str(text.status)))
-        self.treeview.set(text.fullname, "chars", len(text.viewer))
-        self.treeview.set(text.fullname, "age", text.age)
+        self.treeview.item(text.id, tags=tuple(tags))
+        self.treeview.set(text.id, "status", Tr(str(text.status)))
+        # Until the summaries have been displayed, avoid parsing the text.
+        if self.summaries_displayed or text.summarized:
+            self.treeview.set(text.id, "chars", text.length)
+        self.treeview.set(text.id, "age", self.ages.get(text))
+
+    def treeview_update_headings(self, previous):
+        """Update the treeview entries, tabs and views of the items for which
+        the heading or level differs from the previous state.
+        """
+        for item in self.source.all_items:
+            current = (item.heading, item.level)
+            # Items not in the previous state have just been displayed.
+            if previous.get(item.id, current) == current:
+                continue
+            if self.treeview.exists(item.id):
+                self.treeview.item(item.id, text=item.heading)
+            if item.is_text:
+                item.viewer.redisplay()
+                self.texts_notebook.tab(item.tabid, text=item.viewer.heading)
+
+    def items_update(self, previous):
+        """Update the treeview and the texts notebook after items have been
+        created, copied or deleted, given the previous headings of all items.
+        Only the rows and tabs of the added or removed items are changed.
+        The viewers of the other texts are kept, and only those whose
+        heading has changed are displayed anew.
+        """
+        ids = self.source.ids
+        for text in list(self.texts_notebook_lookup.values()):
+            if text.id not in ids:
+                self.texts_notebook.forget(text.tabid)
+                self.texts_notebook_lookup.pop(text.tabid)
+                self.texts_displayed.pop(text.id, None)
+        # Deleting the row of a section also deletes the rows of its items.
+        for id in previous:
+            if id not in ids and self.treeview.exists(id):
+                self.treeview.delete(id)
+        # Added sections are followed by their sub-items.
+        for item in self.source.all_items:
+            if item.id not in previous:
+                self.add_treeview_entry(item, index=item.index)
+        for position, text in enumerate(self.source.all_texts):
+            if text.id not in previous:
+                self.texts_notebook_add(text)
+                self.texts_notebook.insert(position, text.tabid)
+        self.treeview_update_headings(previous)
+
+    def get_headings(self):
+        "Get the current heading and level of all items, keyed by item id."
+        return dict([(i.id, (i.heading, i.level)) for i in self.source.all_items])
 
     def treeview_update_ages(self):
-        "Periodically update the ages of the texts in the treeview."
-        for text in self.source.all_texts:
-            self.treeview.set(text.fullname, "age", text.age)
-        self.root.after(constants.AGES_UPDATE_DELAY, self.treeview_update_ages)
+        """Periodically update the ages of the texts in the treeview.
+        Only the rows present in the treeview, and with a changed age, are set.
+        The delay until the next update is longer when all these texts are old.
+        """
+        texts = [t for t in self.source.all_texts if t.is_shown]
+        changed, delay = self.ages.update(texts)
+        for text, age in changed:
+            self.treeview.set(text.id, "age", age)
+        self.treeview_schedule_ages(delay)
+
+    def treeview_schedule_ages(self, delay=constants.AGES_UPDATE_DELAY):
+        "Schedule the next update of the ages, replacing any already scheduled."
+        if self.ages_after is not None:
+            self.root.after_cancel(self.ages_after)
+        self.ages_after = self.root.after(delay, self.treeview_update_ages)
 
     def texts_notebook_create(self):
         "Create the texts notebook framework."
@@ -396,7 +570,8 @@ class Main:
         self.texts_notebook_lookup = {}
 
     def texts_notebook_display(self):
-        """Create views for tabs in the texts notebook.
+        """Create viewers for tabs in the texts notebook. Only the text in the
+        selected tab is displayed now; the others when first shown.
         Also updates the text information in the treeview.
         """
         # This is a kludge; not sure why it is needed.
@@ -404,59 +579,97 @@ class Main:
         # First delete any existing text views.
         while self.texts_notebook_lookup:
             self.texts_notebook.forget(self.texts_notebook_lookup.popitem()[0])
+        self.texts_displayed.clear()
 
-        # Create the text views.
+        # Create the text viewers.
+        cursors = self.config["source"].get("cursor", {})
         for text in self.source.all_texts:
-            viewer = TextViewer(self.texts_notebook, self, text)
-            viewer.display()
-            text.viewer = viewer
-            self.texts_notebook.add(
-                viewer.view_frame,
-                text=viewer.heading,
-                state=text.is_shown and tk.NORMAL or tk.HIDDEN,
-            )
-            tabs = self.texts_notebook.tabs()
-            text.tabid = tabs[-1]
-            self.texts_notebook_lookup[text.tabid] = text
-            opener = functools.partial(self.open_text_editor, text=text)
-            viewer.view.bind("<Double-Button-1>", opener)
-            viewer.view.bind("<Return>", opener)
-            viewer.view.bind("<Control-q>", self.quit)
-            viewer.view.bind("<Control-Q>", self.quit)
-            self.treeview_update_info(text)
-            # Place the cursor in the text view.
-            try:
-                text.viewer.cursor = self.config["source"]["cursor"][text.fullname]
-            except KeyError:
-                pass
+            self.texts_notebook_add(text)
+            # Place the cursor in the text view. Older configs use the fullname.
+            position = cursors.get(text.id, cursors.get(text.fullname))
+            if position is not None:
+                text.viewer.cursor = position
 
         # Set selected text tab in notebook.
-        try:
-            text = self.source[self.config["source"]["selected"]]
-            if not text.is_text:
-                raise ValueError
-        except (KeyError, ValueError):
-            pass
-        else:
-            self.treeview.selection_set(text.fullname)
-            self.treeview.see(text.fullname)
-            self.treeview.focus(text.fullname)
+        selected = self.config["source"].get("selected")
+        text = self.source.ids.get(selected) or self.source.get(selected)
+        if text is not None and text.is_text:
+            self.treeview_reveal(text)
+            self.treeview.selection_set(text.id)
+            self.treeview.see(text.id)
+            self.treeview.focus(text.id)
+            text.viewer.show()
             text.viewer.view.focus_set()
             # This is a kludge; not sure why it is needed.
             self.ignore_texts_notebook_tab_changed = True
+        else:
+            try:
+                self.texts_notebook_lookup[self.texts_notebook.select()].viewer.show()
+            except KeyError:
+                pass
 
         self.texts_notebook.bind(
             "<<NotebookTabChanged>>", self.texts_notebook_tab_changed
         )
 
+    def texts_notebook_add(self, text):
+        """Create the viewer for the text, and add its tab last in the texts notebook.
+        The text is not displayed until its tab is first shown.
+        """
+        viewer = TextViewer(self.texts_notebook, self, text)
+        text.viewer = viewer
+        self.texts_notebook.add(
+            viewer.view_frame,
+            text=viewer.heading,
+            state=text.is_shown and tk.NORMAL or tk.HIDDEN,
+        )
+        tabs = self.texts_notebook.tabs()
+        text.tabid = tabs[-1]
+        self.texts_notebook_lookup[text.tabid] = text
+
+    def texts_notebook_set_state(self, texts, state):
+        """Set the state of the tabs for the texts. This is done in a single
+        call to Tk, since a section may contain hundreds of texts.
+        """
+        script = [f"{self.texts_notebook} tab {t.tabid} -state {state}" for t in texts]
+        if script:
+            self.texts_notebook.tk.eval("\n".join(script))
+
+    def texts_viewer_shown(self, text):
+        """Record the text as the most recently shown. Undisplay the least
+        recently shown texts while over the limits for number of texts or
+        characters. Texts being edited are kept displayed.
+        """
+        if not text.viewer.is_displayed:  # May be shown by its editor.
+            return
+        self.texts_displayed[text.id] = text
+        self.texts_displayed.move_to_end(text.id)
+        maximum = self.config["main"].get("viewers_max") or constants.VIEWERS_MAX
+        maximum_chars = (
+            self.config["main"].get("viewers_max_chars") or constants.VIEWERS_MAX_CHARS
+        )
+        count = len(self.texts_displayed)
+        chars = sum([t.length for t in self.texts_displayed.values()])
+        for other in list(self.texts_displayed.values()):
+            if count <= maximum and chars <= maximum_chars:
+                break
+            if other is text or other.id in self.text_editors:
+                continue
+            other.viewer.undisplay()
+            self.texts_displayed.pop(other.id)
+            count -= 1
+            chars -= other.length
+
     def texts_notebook_tab_changed(self, event):
-        "Synchronize selected in treeview with change of text tab."
+        "Display the text if not done, and synchronize selected in treeview."
+        text = self.texts_notebook_lookup[self.texts_notebook.select()]
+        text.viewer.show()
         if self.ignore_texts_notebook_tab_changed:
             self.ignore_texts_notebook_tab_changed = False
             return
-        text = self.texts_notebook_lookup[self.texts_notebook.select()]
-        self.treeview.selection_set(text.fullname)
-        self.treeview.focus(text.fullname)
+        self.treeview_reveal(text)
+        self.treeview.selection_set(text.id)
+        self.treeview.focus(text.id)
 
     def meta_notebook_create(self):
         "Create the meta notebook framework."
@@ -527,6 +740,93 @@ class Main:
                 message=f"{count} {Tr('items written to archive file')} '{filepath}'.",
             )
 
+    def refresh(self, event=None):
+        """Pick up changes to the texts and sections made outside of Au,
+        and update the treeview, the notebook and the meta viewers accordingly.
+        Only the meta viewers showing information affected are redisplayed.
+        """
+        previous = self.get_headings()
+        changeset = self.source.refresh()
+        references = self.references_viewer.source.refresh()
+        if changeset:
+            for item in changeset.removed:
+                if self.treeview.exists(item.id):
+                    self.treeview.delete(item.id)
+                if item.is_text:
+                    self.texts_notebook.forget(item.tabid)
+                    self.texts_notebook_lookup.pop(item.tabid)
+                    self.texts_displayed.pop(item.id, None)
+            # Added sections are followed by their sub-items.
+            for item in changeset.added:
+                self.add_treeview_entry(item)
+                if item.is_text:
+                    self.texts_notebook_add(item)
+            # Editors for texts changed by another program must not silently
+            # overwrite those changes.
+            for text in changeset.modified + changeset.removed:
+                if text.id in self.text_editors:
+                    self.text_editors[text.id].file_changed()
+            for text in changeset.modified:
+                text.viewer.redisplay()
+                self.treeview_update_info(text)
+            if changeset.modified:
+                self.treeview_schedule_ages()
+        if changeset.added or changeset.removed:
+            if __debug__:
+                self.source.check_integrity()
+            self.texts_notebook_reorder_tabs(None)
+            self.treeview_update_headings(previous)
+        if references:
+            for reference in references.modified + references.removed:
+                if reference.id in self.reference_editors:
+                    self.reference_editors[reference.id].file_changed()
+            self.references_viewer.update_references()
+        if not (changeset or references):
+            return "break"
+        indexed = bool(changeset.added or changeset.removed)
+        referenced = indexed or bool(references)
+        for text in changeset.modified:
+            summary = changeset.summaries[text.id]
+            if summary is None or summary[1] != text.indexed:
+                indexed = True
+            if summary is None or summary[2] != text.references:
+                referenced = True
+        self.title_viewer.update_statistics()
+        if referenced:
+            self.references_viewer.display()
+        if indexed:
+            self.indexed_viewer.display()
+        self.search_viewer.clear()
+        return "break"
+
+    def set_watch_files(self):
+        if self.watch_files_var.get():
+            self.watcher_start()
+        else:
+            self.watcher_stop()
+
+    def watcher_start(self):
+        "Start watching for changes to the files made by other programs."
+        if self.watcher is not None:
+            return
+        self.watcher = Watcher(self.absdirpath, skip=[constants.ARCHIVE_DIRNAME])
+        self.watcher.start()
+        self.watcher_check(self.watcher)
+
+    def watcher_stop(self):
+        if self.watcher is None:
+            return
+        self.watcher.stop()
+        self.watcher = None
+
+    def watcher_check(self, watcher):
+        "Periodically check for changes reported by the watcher thread."
+        if watcher is not self.watcher:  # Stopped, or replaced.
+            return
+        if watcher.changed():
+            self.refresh()
+        self.root.after(constants.WATCH_CHECK_DELAY, self.watcher_check, watcher)
+
     def export_docx(self, dirpath=None):
         config = self.config["export"].get("docx", {})
         if self.interactive:
@@ -537,8 +837,10 @@ class Main:
             self.root.config(cursor=constants.WRITE_CURSOR)
         if dirpath:
             config["dirpath"] = dirpath
+        self.source.preload()
         exporter = docx_export.Exporter(self, self.source, config)
         exporter.write()
+        exporter.report_unknown()
         if self.interactive:
             self.config["export"]["docx"] = config
             self.root.config(cursor="")
@@ -553,6 +855,7 @@ class Main:
             self.root.config(cursor=constants.WRITE_CURSOR)
         if dirpath:
             config["dirpath"] = dirpath
+        self.source.preload()
         exporter = pdf_export.Exporter(self, self.source, config)
         try:
             exporter.write()
@@ -564,6 +867,7 @@ class Main:
                 return
             else:
                 sys.exit(f"Error: Wrong number of contents pages: {msg}")
+        exporter.report_unknown()
         if self.interactive:
             self.config["export"]["pdf"] = config
             self.root.config(cursor="")
@@ -578,8 +882,10 @@ class Main:
             self.root.config(cursor=constants.WRITE_CURSOR)
         if dirpath:
             config["dirpath"] = dirpath
+        self.source.preload()
         exporter = epub_export.Exporter(self, self.source, config)
         exporter.write()
+        exporter.report_unknown()
         if self.interactive:
             self.config["export"]["epub"] = config
             self.root.config(cursor="")
@@ -594,8 +900,10 @@ class Main:
             self.root.config(cursor=constants.WRITE_CURSOR)
         if dirpath:
             config["dirpath"] = dirpath
+        self.source.preload()
         exporter = html_export.Exporter(self, self.source, config)
         exporter.write()
+        exporter.report_unknown()
         if self.interactive:
             self.config["export"]["html"] = config
             self.root.config(cursor="")
@@ -603,37 +911,35 @@ class Main:
     def move_item_up(self, event=None):
         "Move the currently selected item up within its level of the treeview."
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return "break"
-        item = self.source[fullname]
-        parentfullname = item.parent.fullname
-        index = self.treeview.index(fullname)
+        previous = self.get_headings()
         try:
             item.move_up()
         except ValueError:
             return "break"
         self.source.check_integrity()
-        self.treeview.move(fullname, parentfullname, index - 1)
+        self.treeview.move(item.id, item.parent.id, item.index)
         self.texts_notebook_reorder_tabs(item)
+        self.treeview_update_headings(previous)
         return "break"
 
     def move_item_down(self, event=None):
         "Move the currently selected item down within its level of the treeview."
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return "break"
-        item = self.source[fullname]
-        parentfullname = item.parent.fullname
-        index = self.treeview.index(fullname)
+        previous = self.get_headings()
         try:
             item.move_down()
         except ValueError:
             return "break"
         self.source.check_integrity()
-        self.treeview.move(fullname, parentfullname, index + 1)
+        self.treeview.move(item.id, item.parent.id, item.index)
         self.texts_notebook_reorder_tabs(item)
+        self.treeview_update_headings(previous)
         return "break"
 
     def texts_notebook_reorder_tabs(self, item):
@@ -641,49 +947,57 @@ class Main:
         for index, text in enumerate(self.source.all_texts):
             self.texts_notebook.insert(index, text.tabid)
 
+    def item_moved_update(self, item, previous):
+        "Update treeview and tabs after the item has been moved to another section."
+        self.source.check_integrity()
+        if self.treeview_populated(item.parent):
+            self.treeview.move(item.id, item.parent.id, item.index)
+        else:
+            self.treeview.delete(item.id)
+            self.treeview_add_placeholder(item.parent)
+        self.texts_notebook_reorder_tabs(item)
+        # The tabs of the moved texts are shown only if all parents are open.
+        self.texts_notebook_set_state(
+            [t for t in item.all_texts if t.is_shown], tk.NORMAL
+        )
+        self.texts_notebook_set_state(
+            [t for t in item.all_texts if not t.is_shown], tk.HIDDEN
+        )
+        self.treeview_update_headings(previous)
+        self.treeview_reveal(item)
+        self.treeview.selection_set(item.id)
+        self.treeview.see(item.id)
+        self.treeview.focus(item.id)
+        self.refresh_meta_notebook()
+
     def move_item_into_section(self, event=None):
         """Move the currently selected item down one level in hierarchy
         into the section immediately above it at the same level.
         """
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return "break"
-        item = self.source[fullname]
+        previous = self.get_headings()
         try:
             item.move_to_section(item.prev)
         except ValueError:
             return "break"
-        self.source.check_integrity()
-        self.treeview_display()
-        self.treeview.update_idletasks()
-        self.texts_notebook_display()
-        self.texts_notebook.update_idletasks()
-        self.treeview.selection_set(item.fullname)
-        self.treeview.see(item.fullname)
-        self.treeview.focus(item.fullname)
-        self.refresh_meta_notebook()
+        self.item_moved_update(item, previous)
         return "break"
 
     def move_item_out_of_section(self, event=None):
         "Move the currently selected item up one level in the hierachy."
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return "break"
-        item = self.source[fullname]
+        previous = self.get_headings()
         try:
             item.move_to_parent()
         except ValueError:
             return "break"
-        self.source.check_integrity()
-        self.treeview_display()
-        self.treeview.update_idletasks()
-        self.texts_notebook_display()
-        self.texts_notebook.update_idletasks()
-        self.treeview.selection_set(item.fullname)
-        self.treeview.focus(item.fullname)
-        self.refresh_meta_notebook()
+        self.item_moved_update(item, previous)
         return "break"
 
     def edit_title(self):
@@ -725,19 +1039,18 @@ class Main:
         self.title_viewer.display()
 
     def set_display_heading_ordinal(self):
+        previous = self.get_headings()
         self.source.display_heading_ordinal = bool(
             self.display_heading_ordinal_var.get()
         )
-        self.treeview_display()
-        self.texts_notebook_display()
+        self.treeview_update_headings(previous)
 
     def rename(self):
         "Rename the currently selected item."
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return
-        item = self.source[fullname]
         newname = tk.simpledialog.askstring(
             parent=self.root,
             title=Tr("New name"),
@@ -748,6 +1061,7 @@ class Main:
             return
         if newname == item.name:
             return
+        previous = self.get_headings()
         try:
             item.rename(newname)
         except ValueError as error:
@@ -755,29 +1069,20 @@ class Main:
                 parent=self.treeview, title="Error", message=str(error)
             )
             return
-        if item.is_text:
-            item.viewer.display()
-            index = self.treeview.index(fullname)
-            self.treeview.delete(fullname)
-            self.add_treeview_entry(item, index=index)
-            self.treeview_update_info(item)
-            self.texts_notebook.tab(item.tabid, text=item.name)
-        elif item.is_section:
-            self.treeview_display()
-            self.treeview.update_idletasks()
-            self.texts_notebook_display()
-            self.texts_notebook.update_idletasks()
         self.source.check_integrity()
-        self.treeview.selection_set(item.fullname)
-        self.treeview.focus(item.fullname)
+        # The ids are unchanged, so only the changed headings need updating.
+        self.treeview_update_headings(previous)
+        self.treeview.selection_set(item.id)
+        self.treeview.focus(item.id)
+        self.refresh_meta_notebook()
 
     def copy(self):
         "Make a copy of the currently selected item."
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return
-        item = self.source[fullname]
+        previous = self.get_headings()
         newname = f"Copy of {item.name}"
         for i in range(2, 10):
             try:
@@ -794,20 +1099,16 @@ class Main:
             )
             return
         self.source.check_integrity()
-        self.treeview_display()
-        self.treeview.update_idletasks()
-        self.texts_notebook_display()
-        self.texts_notebook.update_idletasks()
-        self.treeview.selection_set(newitem.fullname)
-        self.treeview.focus(newitem.fullname)
+        self.items_update(previous)
+        self.treeview.selection_set(newitem.id)
+        self.treeview.focus(newitem.id)
         self.refresh_meta_notebook()
 
     def delete(self):
         try:
-            fullname = self.treeview.selection()[0]
+            item = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return
-        item = self.source[fullname]
         if item.is_text:
             if not tk.messagebox.askokcancel(
                 parent=self.treeview,
@@ -822,37 +1123,28 @@ class Main:
                 message=f"{Tr('Really delete section')} '{item.fullname}' {Tr('and all its contents?')}",
             ):
                 return
-        if item.is_text:
-            self.treeview.delete(fullname)
-            self.texts_notebook.forget(item.tabid)
-            self.texts_notebook_lookup.pop(item.tabid)
-            item.delete()
-        else:
-            item.delete()
-            self.treeview_display()
-            self.treeview.update_idletasks()
-            self.texts_notebook_display()
-            self.texts_notebook.update_idletasks()
+        previous = self.get_headings()
+        item.delete()
         self.source.check_integrity()
+        self.items_update(previous)
         self.refresh_meta_notebook()
 
     def open_text_editor(self, event=None, text=None):
         if text is None:
             try:
-                fullname = self.treeview.selection()[0]
+                text = self.source.ids[self.treeview.selection()[0]]
             except IndexError:
                 return "break"
-            text = self.source[fullname]
             if not text.is_text:
                 return "break"
         try:
-            editor = self.text_editors[text.fullname]
+            editor = self.text_editors[text.id]
         except KeyError:
             editor = TextEditor(self, text)
             editor.display()
             editor.cursor = text.viewer.cursor
             editor.modified = False
-            self.text_editors[text.fullname] = editor
+            self.text_editors[text.id] = editor
         else:
             editor.toplevel.lift()
         self.set_menubar_state()
@@ -863,9 +1155,10 @@ class Main:
     def save_text_editor(self, editor):
         "Updates following text save."
         editor.text.read()
-        editor.text.viewer.display()
+        editor.text.viewer.redisplay()
         editor.text.viewer.cursor = editor.cursor
         self.treeview_update_info(editor.text)
+        self.treeview_schedule_ages()
         self.refresh_meta_notebook()
 
     def refresh_meta_notebook(self):
@@ -876,18 +1169,18 @@ class Main:
 
     def close_text_editor(self, editor):
         "Remove editor from lookup and update."
-        self.text_editors.pop(editor.text.fullname)
+        self.text_editors.pop(editor.text.id)
         self.set_menubar_state()
 
     def open_reference_editor(self, viewer, reference, event=None):
         try:
-            editor = self.reference_editors[reference.fullname]
+            editor = self.reference_editors[reference.id]
         except KeyError:
             editor = ReferenceEditor(self, viewer, reference)
             editor.display()
             editor.cursor_home()
             editor.modified = False
-            self.reference_editors[reference.fullname] = editor
+            self.reference_editors[reference.id] = editor
         else:
             editor.toplevel.lift()
         editor.view.update_idletasks()
@@ -896,7 +1189,7 @@ class Main:
 
     def create_text(self):
         try:
-            anchor = self.source[self.treeview.selection()[0]]
+            anchor = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             anchor = None
         name = tk.simpledialog.askstring(
@@ -906,6 +1199,7 @@ class Main:
         )
         if not name:
             return
+        previous = self.get_headings()
         try:
             text = self.source.create_text(name, anchor)
         except ValueError as error:
@@ -914,21 +1208,18 @@ class Main:
             )
             return
         self.source.check_integrity()
-        self.treeview_display()
-        self.treeview.update_idletasks()
-        self.texts_notebook_display()
-        self.texts_notebook.update_idletasks()
-        self.treeview.see(text.fullname)
-        self.treeview.selection_set(text.fullname)
-        self.treeview.focus(text.fullname)
+        self.items_update(previous)
+        self.treeview_reveal(text)
+        self.treeview.see(text.id)
+        self.treeview.selection_set(text.id)
+        self.treeview.focus(text.id)
         self.title_viewer.update_statistics()
 
     def create_section(self):
         try:
-            fullname = self.treeview.selection()[0]
+            anchor = self.source.ids[self.treeview.selection()[0]]
         except IndexError:
             return
-        anchor = self.source[fullname]
         name = tk.simpledialog.askstring(
             parent=self.treeview,
             title=Tr("New section"),
@@ -936,6 +1227,7 @@ class Main:
         )
         if not name:
             return
+        previous = self.get_headings()
         try:
             section = self.source.create_section(anchor, name)
         except ValueError as error:
@@ -944,21 +1236,19 @@ class Main:
             )
             return
         self.source.check_integrity()
-        self.treeview_display()
-        self.treeview.update_idletasks()
-        self.texts_notebook_display()
-        self.texts_notebook.update_idletasks()
-        self.treeview.selection_set(section.fullname)
-        self.treeview.see(section.fullname)
-        self.treeview.focus(section.fullname)
+        self.items_update(previous)
+        self.treeview_reveal(section)
+        self.treeview.selection_set(section.id)
+        self.treeview.see(section.id)
+        self.treeview.focus(section.id)
         self.title_viewer.update_statistics()
 
     def popup_menu(self, event):
-        fullname = self.treeview.identify_row(event.y)
-        if not fullname:
+        iid = self.treeview.identify_row(event.y)
+        if not iid:
             return
-        self.treeview.selection_set(fullname)
-        self.treeview.focus(fullname)
+        self.treeview.selection_set(iid)
+        self.treeview.focus(iid)
         self.menu_popup.tk_popup(event.x_root, event.y_root)
 
     def run(self):
@@ -977,9 +1267,23 @@ class Main:
         ):
             return
         self.config_save()
+        self.search_viewer.save_index()
+        self.watcher_stop()
         self.root.destroy()
 
 
+def read_config(absdirpath):
+    "Return the configuration in the file in the given directory, or a default."
+    try:
+        with open(os.path.join(absdirpath, constants.CONFIG_FILENAME)) as infile:
+            config = json.load(infile)
+        if "main" not in config:
+            raise ValueError  # Invalid JSON content.
+    except (OSError, json.JSONDecodeError, ValueError):
+        config = dict(main={}, meta={}, source={}, export={})
+    return config
+
+
 class AuthorsDialog(tk.simpledialog.Dialog):
     "Dialog to edit the list of authors."
 
@@ -1045,6 +1349,24 @@ if __name__ == "__main__":
     group.add_argument("--pdf", action="store_true", help="Output texts as PDF.")
     group.add_argument("--epub", action="store_true", help="Output texts as EPUB.")
     group.add_argument("--html", action="store_true", help="Output texts as HTML.")
+    group.add_argument(
+        "--search",
+        metavar="TERM",
+        default=None,
+        help="Output the hits for the term in the texts, using the search index.",
+    )
+    parser.add_argument(
+        "-i",
+        "--ignore-case",
+        action="store_true",
+        help="Character case is not significant when searching.",
+    )
+    parser.add_argument(
+        "-r",
+        "--regexp",
+        action="store_true",
+        help="The search term is a regular expression.",
+    )
     parser.add_argument(
         "-D",
         "--dirpath",
@@ -1075,5 +1397,29 @@ if __name__ == "__main__":
         Main(inputdir, interactive=False).export_epub(dirpath=args.dirpath)
     elif args.html:
         Main(inputdir, interactive=False).export_html(dirpath=args.dirpath)
+    elif args.search:
+        # No Tk root is needed for this; only the configuration of the source.
+        config = read_config(inputdir)
+        source = Source(inputdir, workers=config["main"].get("parse_workers"))
+        source.apply_config(config["source"])
+        index = SearchIndex(os.path.join(inputdir, constants.SEARCH_INDEX_FILENAME))
+        index.update(index.get_contents(source.all_texts))
+        index.prune()
+        # The texts may have been read anew; keep them for the next time.
+        source.save_cache()
+        try:
+            index.save()
+        except OSError:
+            pass
+        try:
+            found = index.search(
+                args.search, case=not args.ignore_case, regexp=args.regexp
+            )
+        except ValueError as error:
+            sys.exit(f"{Tr('Error')}: {error}")
+        for text in source.all_texts:
+            chars = index.get_chars(text.id)
+            for first, last in found.get(text.id, []):
+                print(f"{text.fullname}: {''.join(get_fragment(chars, first, last))}")
     else:
         Main(inputdir).run()
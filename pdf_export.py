@@ -16,6 +16,7 @@ import fpdf
 import utils
 import constants
 from utils import Tr
+from visitor import Visitor
 
 FONTDIR = "/usr/share/fonts/truetype/freefont"
 
@@ -49,7 +50,7 @@ REFERENCES_XREF_DISPLAY = (
 )
 
 
-class Exporter:
+class Exporter(Visitor):
     "HTML exporter."
 
     def __init__(self, main, source, config):
@@ -478,21 +479,11 @@ class Exporter:
                 self.state.reset()
             self.state.ln()
 
-    def render(self, ast):
-        try:
-            method = getattr(self, f"render_{ast['element']}")
-        except AttributeError:
-            ic("Could not handle ast", ast)
-        else:
-            method(ast)
-
     def render_document(self, ast):
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
 
     def render_paragraph(self, ast):
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         if self.list_stack:
             if self.list_stack[-1]["tight"]:
                 self.state.ln()
@@ -515,8 +506,7 @@ class Exporter:
             left_indent=constants.QUOTE_LEFT_INDENT,
             right_indent=constants.QUOTE_RIGHT_INDENT,
         )
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
 
     def render_code_span(self, ast):
@@ -530,8 +520,7 @@ class Exporter:
             left_indent=constants.CODE_INDENT,
             line_height=1.2,
         )
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
         self.state.ln()
 
@@ -541,21 +530,18 @@ class Exporter:
             left_indent=constants.CODE_INDENT,
             line_height=1.2,
         )
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
         self.state.ln()
 
     def render_emphasis(self, ast):
         self.state.set(style="I")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
 
     def render_strong_emphasis(self, ast):
         self.state.set(style="B")
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
 
     def render_thematic_break(self, ast):
@@ -596,8 +582,7 @@ class Exporter:
         )
         self.list_stack.append(data)
         self.state.set(line_height=1.1)
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
         if self.list_stack[-1]["tight"]:
             self.state.ln()
@@ -613,8 +598,7 @@ class Exporter:
             self.state.write("- ")
         self.state.reset()
         self.state.set(left_indent=data["depth"] * constants.LIST_INDENT)
-        for child in ast["children"]:
-            self.render(child)
+        self.render_children(ast)
         self.state.reset()
 
     def render_indexed(self, ast):
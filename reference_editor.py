@@ -38,12 +38,12 @@ class ReferenceEditor(Editor):
             return
         self.viewer.references.remove(self.text)
         self.viewer.references_lookup.pop(self.text["id"])
-        self.main.reference_editors.pop(self.text.fullname)
+        self.main.reference_editors.pop(self.text.id)
         self.text.delete()
         self.viewer.display()
         self.toplevel.destroy()
 
     def close_finalize(self):
         "Perform action at window closing time."
-        self.main.reference_editors.pop(self.text.fullname)
+        self.main.reference_editors.pop(self.text.id)
         self.text.read()
@@ -23,6 +23,9 @@ from viewer import Viewer
 class ReferencesViewer(Viewer):
     "Viewer for the references."
 
+    # The links and references are tagged individually.
+    POOLED_TAGS = False
+
     def __init__(self, parent, main):
         super().__init__(parent, main)
         self.read_references()
@@ -107,6 +110,10 @@ class ReferencesViewer(Viewer):
         self.source = Source(
             os.path.join(self.main.absdirpath, constants.REFERENCES_DIRNAME)
         )
+        self.update_references()
+
+    def update_references(self):
+        "Update the list and lookup of references from the source."
         self.reference_texts = [t for t in self.source.all_texts if "id" in t]
         self.reference_texts.sort(key=lambda r: r["id"].lower())
         self.reference_lookup = dict([(r["id"], r) for r in self.reference_texts])
@@ -119,12 +126,10 @@ class ReferencesViewer(Viewer):
     def display_initialize(self):
         super().display_initialize()
         self.reference_pos = {}  # Key: reference id; value: position here.
-        self.texts_pos = {}  # Position in the source text.
+        self.texts_count = {}  # Number of occurrences in the source texts.
         for text in self.main.source.all_texts:
-            for id, positions in text.viewer.references.items():
-                self.texts_pos.setdefault(id, {})[text.fullname] = list(
-                    sorted(positions)
-                )
+            for id, count in text.references.items():
+                self.texts_count.setdefault(id, {})[text.fullname] = count
 
     def display_view(self):
         for reference in self.reference_texts:
@@ -261,20 +266,19 @@ class ReferencesViewer(Viewer):
             )
 
     def display_view_xrefs(self, reference):
-        fullnames = self.texts_pos.get(reference["id"]) or {}
+        fullnames = self.texts_count.get(reference["id"]) or {}
         reference["orphan"] = not fullnames
         if not fullnames:
             return
         self.view.insert(tk.INSERT, "\n")
         after_first = False
-        for fullname, positions in sorted(fullnames.items()):
-            positions = sorted(positions, key=lambda p: int(p[: p.index(".")]))
-            for position in positions:
+        for fullname, count in sorted(fullnames.items()):
+            for number in range(1, count + 1):
                 if after_first:
                     self.view.insert(tk.INSERT, ", ")
                 else:
                     after_first = True
-                self.xref_create(fullname, position, constants.REFERENCE)
+                self.xref_create(fullname, reference["id"], number, constants.REFERENCE)
 
     def highlight(self, refid):
         "Highlight and ensure that the reference and this pane is visible."
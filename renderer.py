@@ -0,0 +1,386 @@
+"""Rendering of the AST of a Markdown text into operations for a tk.Text instance.
+This is pure Python; no calls are made to Tk. The operations are applied
+to the tk.Text instance by the viewer, with insertions done in batches.
+"""
+
+from icecream import ic
+
+import re
+
+import constants
+
+from visitor import Visitor
+
+# Characters outside the Basic Multilingual Plane.
+ASTRAL_RX = re.compile("[\U00010000-\U0010ffff]")
+
+# The kinds of operations. Positions are offsets within the stream, counted
+# in characters as Tk does.
+INSERT = "insert"  # (INSERT, chars, tags); tags None if to be inherited.
+WINDOW = "window"  # (WINDOW, conceptmap YAML); occupies one character.
+TAG_ADD = "tag_add"  # (TAG_ADD, tag, first, last)
+CONFIGURE = "configure"  # (CONFIGURE, tag, options)
+ELIDE = "elide"  # (ELIDE, tag)
+DELETE_LAST = "delete_last"  # (DELETE_LAST,) Delete the last inserted character.
+
+
+class Renderer(Visitor):
+    """Render the AST of a Markdown text into streams of operations.
+    The main stream is to be inserted at the current position. Each footnote
+    definition is a stream of its own, to be inserted after its reference.
+    The dictionaries of links, lists and footnotes are those of the viewer,
+    and are updated in place.
+    The intervals of links, indexed terms and references are recorded as
+    offsets from the start of the rendered output, taking the footnote
+    definitions into account.
+    If 'astral' is true, Tk counts a character outside the Basic Multilingual
+    Plane as two.
+    If 'pooled' is true, tags are shared by all elements with the same
+    appearance, such as the list items at the same level. Otherwise each
+    list, list item, link, indexed term and reference has its own tag.
+    """
+
+    def __init__(self, links, list_lookup, footnotes, astral=False, pooled=False):
+        self.links = links
+        self.list_lookup = list_lookup
+        self.footnotes = footnotes
+        self.astral = astral
+        self.pooled = pooled
+        self.streams = []  # List of (insertion offset or None, operations).
+        self.footnote_defs = []  # Rendered after the rest of the document.
+        self.configured = set()  # Tags already configured.
+        self.intervals = []  # List of [first, last, tag, value].
+        self.footnote_refs = {}  # Key: label; value: offset after first reference.
+        self.prev_line_blank = True
+        self.list_stack = []
+        self.begin_stream()
+
+    def begin_stream(self, start=None):
+        "Begin a new stream of operations, to be inserted at the given offset."
+        self.ops = []
+        self.offset = 0
+        self.start = start or 0
+        self.last = ""  # The last character inserted.
+        # Intervals and footnote reference ends within the stream.
+        self.stream_intervals = []
+        self.stream_footnote_refs = []
+        self.streams.append((start, self.ops))
+
+    def end_stream(self):
+        """Displace the positions beyond the insertion point of the stream,
+        and add the positions within it.
+        """
+        for interval in self.intervals:
+            if interval[0] >= self.start:
+                interval[0] += self.offset
+            if interval[1] > self.start:
+                interval[1] += self.offset
+        # The end of a footnote reference is not displaced by its definition.
+        for label, offset in self.footnote_refs.items():
+            if offset > self.start:
+                self.footnote_refs[label] = offset + self.offset
+        for interval in self.stream_intervals:
+            interval[0] += self.start
+            interval[1] += self.start
+            self.intervals.append(interval)
+        for label, offset in self.stream_footnote_refs:
+            offset += self.start
+            self.footnote_refs[label] = min(
+                offset, self.footnote_refs.get(label, offset)
+            )
+
+    def interval_add(self, tag, first, value):
+        "Record the value for the interval from the first to the current position."
+        self.stream_intervals.append([first, self.offset, tag, value])
+
+    def insert(self, chars, tags=None):
+        self.ops.append((INSERT, chars, tags))
+        self.offset += self.length(chars)
+        if chars:
+            self.last = chars[-1]
+
+    def length(self, chars):
+        "Return the number of characters, as counted by Tk."
+        if self.astral and not chars.isascii():
+            return len(chars) + len(ASTRAL_RX.findall(chars))
+        return len(chars)
+
+    def tag_add(self, tag, first, last=None):
+        "Add the tag from the first position to the given, or the current."
+        if last is None:
+            last = self.offset
+        self.ops.append((TAG_ADD, tag, first, last))
+
+    def tag_configure(self, tag, **options):
+        "Configure the tag, unless already done."
+        if tag in self.configured:
+            return
+        self.configured.add(tag)
+        self.ops.append((CONFIGURE, tag, options))
+
+    def line_break(self):
+        self.insert("\n")
+        self.prev_line_blank = True
+
+    def conditional_line_break(self):
+        if self.prev_line_blank:
+            return
+        self.insert("\n")
+        self.prev_line_blank = True
+
+    def render_document(self, ast):
+        self.prev_line_blank = True
+        self.render_children(ast)
+        self.end_stream()
+        for ast in self.footnote_defs:
+            self.render_footnote_def_stream(ast)
+        self.footnote_defs = []
+
+    def render_heading(self, ast):
+        "Render as ordinary text on its own line."
+        self.conditional_line_break()
+        self.render_children(ast)
+        self.line_break()
+
+    def render_paragraph(self, ast):
+        self.conditional_line_break()
+        if self.list_stack:
+            data = self.list_stack[-1]
+            if not data["tight"] and not data["first_paragraph"]:
+                self.line_break()
+                self.line_break()
+            data["first_paragraph"] = False
+        self.render_children(ast)
+        if not self.list_stack:
+            self.line_break()
+            self.line_break()
+
+    def render_emphasis(self, ast):
+        first = self.offset
+        self.render_children(ast)
+        self.tag_add(constants.ITALIC, first)
+
+    def render_strong_emphasis(self, ast):
+        first = self.offset
+        self.render_children(ast)
+        self.tag_add(constants.BOLD, first)
+
+    def render_raw_text(self, ast):
+        line = ast["children"]
+        if not type(line) == str:
+            ic("could not handle", ast)
+            return
+        if line[-1] == "\n":
+            line = line[:-1] + " "
+        self.insert(line)
+
+    def render_line_break(self, ast):
+        pass
+
+    def render_blank_line(self, ast):
+        pass
+
+    def render_quote(self, ast):
+        self.conditional_line_break()
+        first = self.offset
+        self.render_children(ast)
+        self.tag_add(constants.QUOTE, first)
+
+    def render_code_span(self, ast):
+        self.insert(ast["children"], (constants.CODE_SPAN,))
+
+    def render_code_block(self, ast):
+        self.conditional_line_break()
+        first = self.offset
+        self.render_children(ast)
+        self.tag_add(constants.CODE_BLOCK, first)
+        self.line_break()
+        self.line_break()
+
+    def render_fenced_code(self, ast):
+        self.conditional_line_break()
+        if ast["lang"] == constants.CONCEPTMAP:
+            self.ops.append((WINDOW, ast["children"][0]["children"]))
+            self.offset += 1
+            self.last = ""
+        else:
+            first = self.offset
+            self.render_children(ast)
+            self.tag_add(constants.FENCED_CODE, first)
+        self.line_break()
+        self.line_break()
+
+    def render_literal(self, ast):
+        self.insert(ast["children"])
+
+    def render_thematic_break(self, ast):
+        self.conditional_line_break()
+        self.insert(constants.EM_DASH * 20, (constants.THEMATIC_BREAK,))
+        self.line_break()
+        self.line_break()
+
+    def render_link(self, ast):
+        first = self.offset
+        self.render_children(ast)
+        tag = f"{constants.LINK_PREFIX}{len(self.links) + 1}"
+        link = dict(tag=tag, url=ast["dest"], title=ast["title"])
+        self.links[tag] = link
+        self.tag_add(constants.LINK, first)
+        if not self.pooled:
+            self.tag_add(tag, first)
+        self.interval_add(constants.LINK, first, link)
+
+    def render_list(self, ast):
+        # Begin list on a new line.
+        level = len(self.list_stack)
+        if level > 0:
+            self.insert("\n")
+            if not self.list_stack[-1]["tight"]:
+                self.insert("\n")
+
+        # The number and tags of the list.
+        number = len(self.list_lookup) + 1
+        list_tag = f"{constants.LIST_PREFIX}{number}"
+        item_tag_prefix = f"{constants.LIST_ITEM_PREFIX}{number}-"
+        if self.pooled:
+            bullet_tag = f"{constants.LIST_BULLET_LEVEL_PREFIX}{level}"
+        else:
+            bullet_tag = f"{constants.LIST_BULLET_PREFIX}{number}"
+        self.tag_configure(
+            bullet_tag,
+            font=constants.FONT_BOLD,
+            lmargin1=constants.LIST_INDENT * level,
+        )
+
+        # The data for this list.
+        data = dict(
+            number=number,
+            list_tag=list_tag,
+            item_tag_prefix=item_tag_prefix,
+            bullet_tag=bullet_tag,
+            ordered=ast["ordered"],
+            bullet=ast["bullet"],
+            start=ast["start"],
+            tight=ast["tight"],
+            count=0,
+            level=level,
+        )
+        self.list_lookup[list_tag] = data
+        self.list_stack.append(data)
+
+        # Remember where this list starts.
+        first = self.offset
+
+        # Render children, i.e. list items.
+        for child in ast["children"]:
+            self.prev_line_blank = True
+            self.render(child)
+
+        # Set the overall tag for this list.
+        if not self.pooled:
+            self.tag_add(list_tag, first)
+        if level == 0:
+            self.line_break()
+        self.list_stack.pop()
+        if self.list_stack:
+            self.list_stack[-1]["previous_was_list"] = True
+
+    def render_list_item(self, ast):
+        data = self.list_stack[-1]
+        data["count"] += 1
+        data["first_paragraph"] = True
+
+        # Add bullet for item.
+        if data["ordered"]:
+            bullet = f"{data['start'] + data['count'] - 1}. "
+        else:
+            bullet = f"{data['bullet']}  "
+        self.insert(bullet, (data["bullet_tag"],))
+
+        # Create item tag and output item content.
+        if self.pooled:
+            item_tag = f"{constants.LIST_ITEM_LEVEL_PREFIX}{data['level']}"
+        else:
+            item_tag = f"{data['item_tag_prefix']}{data['count']}"
+            self.list_lookup[item_tag] = data
+        indent = constants.LIST_INDENT * (data["level"] + 1)
+        self.tag_configure(item_tag, lmargin1=indent, lmargin2=indent)
+        first = self.offset
+        self.render_children(ast)
+        if self.list_stack:
+            if self.list_stack[-1].get("previous_was_list"):
+                self.list_stack[-1]["previous_was_list"] = False
+            else:
+                self.insert("\n")
+        if not data["tight"]:
+            self.insert("\n")
+        self.tag_add(item_tag, first)
+
+    def render_indexed(self, ast):
+        first = self.offset
+        if self.pooled:
+            self.insert(ast["term"], (constants.INDEXED,))
+        else:
+            tag = constants.INDEXED_PREFIX + ast["canonical"]
+            self.insert(ast["term"], (constants.INDEXED, tag))
+        self.interval_add(constants.INDEXED, first, ast["canonical"])
+
+    def render_reference(self, ast):
+        first = self.offset
+        if self.pooled:
+            self.insert(ast["reference"], (constants.REFERENCE,))
+        else:
+            tag = (constants.REFERENCE_PREFIX + ast["reference"]).replace(" ", "_")
+            self.insert(ast["reference"], (constants.REFERENCE, tag))
+        self.interval_add(constants.REFERENCE, first, ast["reference"])
+
+    def render_footnote_ref(self, ast):
+        label = ast["label"]
+        tag = constants.FOOTNOTE_REF_PREFIX + label
+        self.footnotes[label] = dict(label=label, tag=tag)
+        self.insert(f"^{label}", (constants.FOOTNOTE_REF, tag))
+        self.stream_footnote_refs.append((label, self.offset))
+
+    def render_footnote_def(self, ast):
+        "The footnote definition is rendered after the rest of the document."
+        self.footnote_defs.append(ast)
+
+    def render_footnote_def_stream(self, ast):
+        "Render the footnote definition as a stream to insert after its reference."
+        self.begin_stream(self.footnote_refs[ast["label"]])
+        self.insert("\n")  # For nicer appearance; do not save.
+        self.render_children(ast)
+        # Remove newline from last paragraph in footnote def, for nicer appearance.
+        if self.last == "\n":
+            self.ops.append((DELETE_LAST,))
+            self.offset -= 1
+        self.tag_add(constants.FOOTNOTE_DEF, 1)
+        tag = constants.FOOTNOTE_DEF_PREFIX + ast["label"]
+        self.ops.append((ELIDE, tag))
+        self.tag_add(tag, 0)
+        self.end_stream()
+
+    def get_chars(self):
+        """Return all characters of the rendered output as a string, with the
+        footnote definitions inserted after their references, as in the view.
+        An embedded window is represented by a blank. Positions are correct
+        only if 'astral' is false, since Python counts characters as such.
+        """
+        result = ""
+        for offset, ops in self.streams:
+            chars = []
+            for op in ops:
+                if op[0] == INSERT:
+                    chars.append(op[1])
+                elif op[0] == WINDOW:
+                    chars.append(" ")
+                elif op[0] == DELETE_LAST:
+                    while not chars[-1]:
+                        chars.pop()
+                    chars[-1] = chars[-1][:-1]
+            chars = "".join(chars)
+            if offset is None:
+                result += chars
+            else:
+                result = result[:offset] + chars + result[offset:]
+        return result
@@ -0,0 +1,357 @@
+"Full-text index of the texts in a source, for searching without the viewers."
+
+from icecream import ic
+
+import collections
+import os
+import pickle
+import re
+
+try:
+    import re._parser as sre_parse  # Python 3.11 and later.
+except ImportError:
+    import sre_parse
+
+import marko
+
+import constants
+import source
+
+from renderer import Renderer
+
+# The index depends on the characters produced by the parser and the renderer.
+SEARCH_INDEX_VERSION = (constants.__version__, marko.__version__, 2)
+
+TOKEN_RX = re.compile(r"\w+")
+
+REPEATS = set([sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT])
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    REPEATS.add(sre_parse.POSSESSIVE_REPEAT)
+
+
+def get_trigrams(chars):
+    "Return the set of trigrams in the characters, ignoring case."
+    chars = chars.casefold()
+    return set(map("".join, zip(chars, chars[1:], chars[2:])))
+
+
+def get_fragment(chars, first, last):
+    """Return the characters before the hit, of the hit, and after the hit,
+    with some context, ellipses where cut, and newlines as blanks.
+    """
+    start = max(0, first - constants.SEARCH_FRAGMENT)
+    finish = last + constants.SEARCH_FRAGMENT
+    before = chars[start:first].replace("\n", " ")
+    if start != 0:
+        before = "..." + before
+    after = chars[last:finish].replace("\n", " ")
+    if finish < len(chars):
+        after += "..."
+    return before, chars[first:last], after
+
+
+class SearchIndex:
+    """Index of the characters of each text as displayed by its viewer,
+    excluding the heading. The entries are keyed by the digest of the
+    content of the file, so an entry is stale when the text has been
+    changed, and texts with the same content share an entry.
+    The postings of each token are the offsets of its occurrences in each
+    entry. The trigrams of each entry, ignoring case, are used to select
+    those that may match a regular expression, and the trigrams of each
+    token to select the tokens that may contain a given one.
+    The positions returned by a search are offsets in the characters of
+    the text, counted by Python.
+    If a file path is given, the index is loaded from it when the contents
+    are first obtained, and can be saved to it, to be kept between sessions.
+    """
+
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.loaded = False
+        self.modified = False
+        self.digests = {}  # Key: text id; value: digest of the current content.
+        self.chars = {}  # Key: digest; value: characters of the text.
+        # Key: token; value: dict with key digest, value list of offsets.
+        self.postings = {}
+        self.trigrams = {}  # Key: trigram; value: set of digests.
+        self.token_trigrams = {}  # Key: trigram; value: set of tokens.
+
+    def __len__(self):
+        return len(self.chars)
+
+    def load(self):
+        "Load the index file, if any. An invalid or outdated file is ignored."
+        self.loaded = True
+        if not self.filepath:
+            return
+        try:
+            with open(self.filepath, "rb") as infile:
+                data = pickle.load(infile)
+            if data["version"] != SEARCH_INDEX_VERSION:
+                raise ValueError
+            self.chars = data["chars"]
+            self.postings = data["postings"]
+            self.trigrams = data["trigrams"]
+            self.token_trigrams = data["token_trigrams"]
+        except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            KeyError,
+            TypeError,
+            ValueError,
+        ):
+            self.chars = {}
+            self.postings = {}
+            self.trigrams = {}
+            self.token_trigrams = {}
+
+    def save(self):
+        "Save the index file, if modified. Raise OSError if any problem."
+        if not self.filepath or not self.modified:
+            return
+        tmpfilepath = self.filepath + ".tmp"
+        with open(tmpfilepath, "wb") as outfile:
+            pickle.dump(
+                dict(
+                    version=SEARCH_INDEX_VERSION,
+                    chars=self.chars,
+                    postings=self.postings,
+                    trigrams=self.trigrams,
+                    token_trigrams=self.token_trigrams,
+                ),
+                outfile,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmpfilepath, self.filepath)
+        self.modified = False
+
+    def get_contents(self, texts):
+        """Return the list of (id, digest, absolute file path) for the current
+        content of the texts. To be done in the thread owning the texts.
+        """
+        return [(t.id, t.stat[2], t.abspath) for t in texts]
+
+    def update(self, contents, cancelled=None):
+        """Index the contents, as given by 'get_contents', not yet indexed.
+        Their files are read and parsed here, without using the parse cache
+        of the source or its parser, so this may be done in another thread.
+        The ASTs are not kept. Entries for content no longer current are kept
+        until pruned. If the function 'cancelled' is given, it is called
+        before indexing each content, and if it returns true, the update is
+        stopped and False is returned.
+        """
+        if not self.loaded:
+            self.load()
+        self.digests = dict([(id, digest) for id, digest, abspath in contents])
+        markdown = None
+        for id, digest, abspath in contents:
+            if digest in self.chars:
+                continue
+            if cancelled is not None and cancelled():
+                return False
+            with open(abspath) as infile:
+                content = infile.read()
+            # The file may have been changed since it was read for the text.
+            digest = source.get_digest(content)
+            self.digests[id] = digest
+            if digest in self.chars:
+                continue
+            if markdown is None:
+                markdown = source.get_parser()
+            frontmatter, content = source.parse_frontmatter(content)
+            self.add(digest, source.convert(content, markdown))
+        return True
+
+    def prune(self):
+        """Remove the entries for content not in any text given at the latest
+        update. Nothing is removed if there has been no update.
+        """
+        if not self.digests:
+            return
+        for digest in set(self.chars).difference(self.digests.values()):
+            self.remove(digest)
+
+    def add(self, digest, ast):
+        "Index the content with the given digest and AST."
+        renderer = Renderer({}, {}, {})
+        renderer.render(ast)
+        chars = renderer.get_chars()
+        self.chars[digest] = chars
+        postings = collections.defaultdict(list)
+        for match in TOKEN_RX.finditer(chars):
+            postings[match.group()].append(match.start())
+        for token, offsets in postings.items():
+            try:
+                self.postings[token][digest] = offsets
+            except KeyError:
+                self.postings[token] = {digest: offsets}
+                for trigram in get_trigrams(token):
+                    self.token_trigrams.setdefault(trigram, set()).add(token)
+        for trigram in get_trigrams(chars):
+            self.trigrams.setdefault(trigram, set()).add(digest)
+        self.modified = True
+
+    def remove(self, digest):
+        "Remove the entry for the content with the given digest."
+        chars = self.chars.pop(digest, None)
+        if chars is None:
+            return
+        for token in set(TOKEN_RX.findall(chars)):
+            offsets = self.postings[token]
+            offsets.pop(digest, None)
+            if not offsets:
+                self.postings.pop(token)
+                for trigram in get_trigrams(token):
+                    tokens = self.token_trigrams[trigram]
+                    tokens.discard(token)
+                    if not tokens:
+                        self.token_trigrams.pop(trigram)
+        for trigram in get_trigrams(chars):
+            digests = self.trigrams[trigram]
+            digests.discard(digest)
+            if not digests:
+                self.trigrams.pop(trigram)
+        self.modified = True
+
+    def get_chars(self, id):
+        "Return the characters of the text with the given id, as indexed."
+        return self.chars[self.digests[id]]
+
+    def search(self, term, case=True, regexp=False):
+        """Return a dictionary with key text id, and value the sorted list of
+        (first, last) offsets of the occurrences of the term in the text.
+        The texts are those given at the latest update.
+        """
+        found = self.search_entries(term, case=case, regexp=regexp)
+        result = {}
+        for id, digest in self.digests.items():
+            if found.get(digest):
+                result[id] = found[digest]
+        return result
+
+    def search_entries(self, term, case=True, regexp=False):
+        """Return a dictionary with key digest, and value the sorted list of
+        (first, last) offsets of the occurrences of the term in the entry.
+        A term which is a single token is found from the postings directly.
+        Otherwise the entries containing all its tokens are searched.
+        A regular expression is matched only against the entries containing
+        the trigrams of the literal strings required by it.
+        """
+        flags = 0 if case else re.IGNORECASE
+        if regexp:
+            try:
+                rx = re.compile(term, flags | re.MULTILINE)
+                parsed = sre_parse.parse(term, flags | re.MULTILINE)
+            except re.error as error:
+                raise ValueError(str(error))
+            candidates = self.get_candidates(list(parsed))
+            if candidates is None:
+                candidates = self.chars
+            return self.find(rx, candidates)
+        rx = re.compile(re.escape(term), flags)
+        tokens = TOKEN_RX.findall(term)
+        if not tokens:
+            return self.find(rx, self.chars)
+        if TOKEN_RX.fullmatch(term):
+            # The term may occur several times within another token.
+            result = {}
+            for other in self.get_containing(term, case):
+                spans = [m.span() for m in rx.finditer(other)]
+                if not spans:  # Containing it only when casefolded.
+                    continue
+                for digest, offsets in self.postings[other].items():
+                    found = result.setdefault(digest, [])
+                    for offset in offsets:
+                        for first, last in spans:
+                            found.append((offset + first, offset + last))
+            for found in result.values():
+                found.sort()
+            return result
+        candidates = None
+        for token in set(tokens):
+            digests = set()
+            for other in self.get_containing(token, case):
+                digests.update(self.postings[other])
+            if candidates is None:
+                candidates = digests
+            else:
+                candidates.intersection_update(digests)
+        return self.find(rx, candidates)
+
+    def get_candidates(self, items):
+        """Return the set of digests for the entries that may match the sequence
+        of items of the parsed regular expression, or None if not restricted.
+        An entry must contain the trigrams of every run of literal characters
+        in the sequence, and of those in subpatterns and required repeats.
+        For alternatives, an entry must be a candidate for any of them.
+        """
+        result = None
+        literal = []
+        for op, av in items + [(None, None)]:
+            if op == sre_parse.LITERAL:
+                literal.append(chr(av))
+                continue
+            candidates = [self.get_containing_trigrams("".join(literal))]
+            literal = []
+            if op == sre_parse.SUBPATTERN:
+                candidates.append(self.get_candidates(list(av[-1])))
+            elif op in REPEATS and av[0] >= 1:
+                candidates.append(self.get_candidates(list(av[2])))
+            elif op == sre_parse.BRANCH:
+                alternatives = [self.get_candidates(list(b)) for b in av[1]]
+                if None not in alternatives:
+                    candidates.append(set().union(*alternatives))
+            for digests in candidates:
+                if digests is None:
+                    continue
+                if result is None:
+                    result = set(digests)
+                else:
+                    result.intersection_update(digests)
+        return result
+
+    def get_containing_trigrams(self, chars):
+        """Return the set of digests for the entries containing all trigrams
+        of the characters, or None if there are too few characters.
+        """
+        trigrams = get_trigrams(chars)
+        if not trigrams:
+            return None
+        result = None
+        for trigram in trigrams:
+            digests = self.trigrams.get(trigram, set())
+            if result is None:
+                result = set(digests)
+            else:
+                result.intersection_update(digests)
+        return result
+
+    def get_containing(self, token, case=True):
+        """Return the tokens in the index containing the given token.
+        Only those containing all its trigrams are examined, unless
+        the token is too short to have any.
+        """
+        tokens = None
+        for trigram in get_trigrams(token):
+            other = self.token_trigrams.get(trigram, set())
+            if tokens is None:
+                tokens = set(other)
+            else:
+                tokens.intersection_update(other)
+        if tokens is None:
+            tokens = self.postings
+        if case:
+            return [t for t in tokens if token in t]
+        token = token.casefold()
+        return [t for t in tokens if token in t.casefold()]
+
+    def find(self, rx, digests):
+        "Return the offsets of the non-empty matches in the entries."
+        result = {}
+        for digest in digests:
+            chars = self.chars[digest]
+            found = [m.span() for m in rx.finditer(chars) if m.end() > m.start()]
+            if found:
+                result[digest] = found
+        return result
@@ -2,14 +2,19 @@
 
 from icecream import ic
 
-import functools
+import os
+import queue
+import threading
 
 import tkinter as tk
+import tkinter.messagebox
 import tkinter.ttk
 
 import constants
+import renderer
 import utils
 
+from search_index import SearchIndex, get_fragment
 from viewer import Viewer
 from utils import Tr
 
@@ -19,6 +24,19 @@ class SearchViewer(Viewer):
 
     def __init__(self, parent, main):
         super().__init__(parent, main)
+        self.index = SearchIndex(
+            os.path.join(main.absdirpath, constants.SEARCH_INDEX_FILENAME)
+        )
+        # Only one search thread at a time may update and search the index.
+        self.index_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = None
+        # Incremented for each search; results for a previous one are dropped.
+        self.generation = 0
+        self.query = None
+        self.total = 0  # Number of hits in the result.
+        self.typed_after = None
+        self.check_after = None
         self.result = []
 
     def __str__(self):
@@ -40,6 +58,7 @@ class SearchViewer(Viewer):
         self.search_entry = tk.ttk.Entry(self.entry_frame)
         self.search_entry.grid(row=0, column=1, sticky=(tk.E, tk.W), padx=4)
         self.search_entry.bind("<Return>", self.search)
+        self.search_entry.bind("<KeyRelease>", self.search_typed)
 
         button = tk.ttk.Button(self.entry_frame, text=Tr("Search"), command=self.search)
         button.grid(row=0, column=2, padx=4, pady=4)
@@ -51,6 +70,7 @@ class SearchViewer(Viewer):
             self.entry_frame,
             text=Tr("Character case is significant"),
             variable=self.search_case_var,
+            command=self.search_typed,
         )
         self.search_case.grid(row=1, column=1, sticky=tk.W)
 
@@ -59,6 +79,7 @@ class SearchViewer(Viewer):
             self.entry_frame,
             text=Tr("Allow regular expression") + "\n. ^ [c1...] (...) * + ? e1|e2",
             variable=self.search_regexp_var,
+            command=self.search_typed,
         )
         self.search_regexp.grid(row=2, column=1, sticky=tk.W)
 
@@ -68,110 +89,254 @@ class SearchViewer(Viewer):
         "Add a tag configuration."
         super().configure_tags()
         self.view.tag_configure(constants.SEARCH, lmargin1=constants.SEARCH_INDENT)
+        self.view.tag_configure(
+            constants.SEARCH_MORE, foreground=constants.XREF_COLOR, underline=True
+        )
 
     def bind_tags(self):
         "Add tag bindings."
         super().bind_tags()
         self.view.tag_bind(constants.SEARCH, "<Enter>", self.xref_enter)
         self.view.tag_bind(constants.SEARCH, "<Leave>", self.xref_leave)
+        self.view.tag_bind(constants.SEARCH, "<Button-1>", self.xref_action)
+        self.view.tag_bind(constants.SEARCH_MORE, "<Enter>", self.xref_enter)
+        self.view.tag_bind(constants.SEARCH_MORE, "<Leave>", self.xref_leave)
+        self.view.tag_bind(constants.SEARCH_MORE, "<Button-1>", self.display_more)
 
-    def search(self, event=None):
-        """Search the viewer texts and display the result.
-        Due to an apparent Tk/Tcl bug that affects searches of with
-        tags for elided parts, a work-around has been implemented.
-        Temporarily, all tags with elide set are unset, then restored
-        after the search. Ugly, but it works.
+    def search_typed(self, event=None):
+        "Search for the typed term when no key has been pressed for a while."
+        if self.typed_after is not None:
+            self.view.after_cancel(self.typed_after)
+        self.typed_after = self.view.after(
+            constants.SEARCH_TYPED_DELAY, self.search, None, False
+        )
+
+    def search(self, event=None, explicit=True):
+        """Start searching for the term in a separate thread, which cancels
+        any search in progress. The results are displayed a chapter at a time
+        when found.
+        A typed term is searched for only if it or the options have changed,
+        and if it is long enough. An error in a regular expression is shown
+        only when explicitly searching.
         """
+        if self.typed_after is not None:
+            self.view.after_cancel(self.typed_after)
+            self.typed_after = None
         term = self.search_entry.get()
+        query = (
+            term,
+            bool(self.search_case_var.get()),
+            bool(self.search_regexp_var.get()),
+        )
+        if not explicit:
+            if query == self.query:
+                return
+            if term and len(term) < constants.SEARCH_TYPED_MINIMUM:
+                return
+        self.query = query
+        self.generation += 1
+        self.result = []
+        self.total = 0
+        self.display()
         if not term:
             return
-        self.display()
-        case = self.search_case_var.get()
-        regexp = self.search_regexp_var.get()
-        count_var = tk.IntVar()
-        self.result = []
-        for text in self.main.source.all_texts:
-            text_view = text.viewer.view
-            found = []
-            elided_tags = set()
-            for tag in text_view.tag_names():  # Elide bug workaround. See above.
-                if text_view.tag_cget(tag, "elide"):
-                    elided_tags.add(tag)
-                    text_view.tag_configure(tag, elide=False)
-            first = text_view.search(
-                term,
-                "1.0",
-                nocase=not case,
-                regexp=regexp,
-                stopindex=tk.END,
-                count=count_var,
+        texts = [(t, t.chapter) for t in self.main.source.all_texts]
+        contents = self.index.get_contents(self.main.source.all_texts)
+        self.thread = threading.Thread(
+            target=self.search_thread,
+            args=(self.generation, texts, contents, query, explicit),
+            daemon=True,
+        )
+        self.thread.start()
+        if self.check_after is None:
+            self.check_after = self.view.after(
+                constants.SEARCH_CHECK_DELAY, self.search_check
             )
-            while first:
-                length = count_var.get()
-                item = text_view.get(first, text_view.index(first + f"+{length}c"))
-                found.append((first, length))
-                first = text_view.search(
-                    term,
-                    first + f"+{length}c",
-                    nocase=not case,
-                    regexp=regexp,
-                    stopindex=tk.END,
-                    count=count_var,
+
+    def search_thread(self, generation, texts, contents, query, explicit):
+        """Update the index from the contents and search it. The hits are
+        all found before any are put into the queue, as a chunk for each
+        chapter. Stop as soon as another search has been started.
+        Any error is put into the queue, to be shown by 'search_check'.
+        This is executed in a separate thread, so Tk must not be used,
+        nor anything else that is not thread-safe, such as the parse cache.
+        """
+        try:
+            with self.index_lock:
+                self.search_index(generation, texts, contents, query, explicit)
+        except Exception as error:
+            self.queue.put((generation, error))
+
+    def search_index(self, generation, texts, contents, query, explicit):
+        "Update and search the index; executed in the search thread."
+
+        def cancelled():
+            return generation != self.generation
+
+        if not self.index.update(contents, cancelled=cancelled):
+            return
+        term, case, regexp = query
+        try:
+            found = self.index.search(term, case=case, regexp=regexp)
+        except ValueError as error:
+            if explicit:
+                self.queue.put((generation, error))
+            return
+        chunk = []
+        current = None
+        for text, chapter in texts:
+            if cancelled():
+                return
+            if text.id not in found:
+                continue
+            if chapter is not current and chunk:
+                self.queue.put((generation, chunk))
+                chunk = []
+            current = chapter
+            chunk.append((text, found[text.id], self.index.get_chars(text.id)))
+        if chunk:
+            self.queue.put((generation, chunk))
+
+    def search_check(self):
+        """Display the next chunk of results from the search thread, if for
+        the current search. Check again while the search is in progress.
+        """
+        self.check_after = None
+        try:
+            generation, chunk = self.queue.get_nowait()
+        except queue.Empty:
+            delay = constants.SEARCH_CHECK_DELAY
+        else:
+            delay = 1  # Let Tk handle events before the next chunk.
+            if generation != self.generation:
+                pass
+            elif isinstance(chunk, Exception):
+                tk.messagebox.showerror(
+                    parent=self.view, title="Error", message=str(chunk)
                 )
-            for tag in elided_tags:  # Elide bug workaround. See above.
-                text_view.tag_configure(tag, elide=True)
-            if found:
-                self.result.append((text, found))
-        self.display()
+            else:
+                self.result.extend(chunk)
+                self.total += sum([len(found) for text, found, chars in chunk])
+                self.display_hits()
+        if self.thread.is_alive() or not self.queue.empty():
+            self.check_after = self.view.after(delay, self.search_check)
+
+    def get_index(self, text, chars, offset, astral):
+        """Return the Tk index in the viewer of the text for the offset
+        in its characters as indexed. If 'astral' is true, Tk counts
+        a character outside the Basic Multilingual Plane as two.
+        """
+        if astral:
+            offset += len(renderer.ASTRAL_RX.findall(chars[:offset]))
+        return f"1.0+{text.viewer.heading_offset + offset}c"
+
+    def display_initialize(self):
+        super().display_initialize()
+        # The value of each interval is (text, chars, first, last) for a hit.
+        self.intervals[constants.SEARCH] = []
+        self.shown = 0  # Number of hits displayed.
+        self.limit = constants.SEARCH_PAGE_SIZE  # Number of hits to display.
+        # Index in the result of the text, and in its hits, to display next.
+        self.position = (0, 0)
 
     def display_heading(self):
         pass
 
     def display_view(self):
-        tag_counter = 0
-        for text, found in self.result:
-            view = text.viewer.view
-            self.view.insert(tk.INSERT, text.fullname, constants.BOLD)
-            self.view.insert(tk.INSERT, "\n")
-            for first, length in found:
-                begin = self.view.index(tk.INSERT)
-                start = view.index(first + f"-{constants.SEARCH_FRAGMENT}c")
-                if start != "1.0":
-                    self.view.insert(tk.INSERT, "...")
-                fragment = view.get(start, first).replace("\n", " ")
-                self.view.insert(tk.INSERT, fragment)
-                last = view.index(first + f"+{length}c")
-                self.view.insert(tk.INSERT, view.get(first, last), constants.HIGHLIGHT)
-                finish = view.index(last + f"+{constants.SEARCH_FRAGMENT}c")
-                fragment = view.get(last, finish).replace("\n", " ")
-                self.view.insert(tk.INSERT, fragment)
-                if finish != view.index(tk.END):
-                    self.view.insert(tk.INSERT, "...")
-                self.view.tag_add(constants.SEARCH, begin, tk.INSERT)
-                tag = f"{constants.SEARCH_PREFIX}{tag_counter}"
-                tag_counter += 1
-                self.view.tag_add(tag, begin, tk.INSERT)
-                self.view.tag_bind(
-                    tag,
-                    "<Button-1>",
-                    functools.partial(
-                        self.xref_action, text=text, first=first, last=last
-                    ),
-                )
-                self.view.insert(tk.INSERT, "\n")
-            self.view.insert(tk.INSERT, "\n")
+        self.display_hits()
+
+    def display_more(self, event=None):
+        "Display another page of hits."
+        self.limit += constants.SEARCH_PAGE_SIZE
+        self.display_hits()
+
+    def display_hits(self):
+        """Display the hits not yet displayed, up to the limit, followed by
+        a line for displaying more if any remain. This is done in a single
+        insertion. The hits share one tag; the hit clicked on is found
+        from its position.
+        """
+        ranges = self.view.tag_ranges(constants.SEARCH_MORE)
+        if ranges:
+            self.view.delete(ranges[0], ranges[-1])
+        self.view.mark_set(tk.INSERT, tk.END)
+        astral = self.view.tk.call("string", "length", "\U0001f600") == 2
+        offset = self.count("1.0", tk.INSERT)
+        insert = []
+
+        def add(chars, tags=()):
+            nonlocal offset
+            insert.append(chars)
+            insert.append(tags)
+            offset += len(chars)
+            if astral:
+                offset += len(renderer.ASTRAL_RX.findall(chars))
+
+        index, number = self.position
+        while index < len(self.result) and self.shown < self.limit:
+            text, found, chars = self.result[index]
+            if number == 0:
+                add(text.fullname, (constants.BOLD,))
+                add("\n")
+            first, last = found[number]
+            begin = offset
+            before, hit, after = get_fragment(chars, first, last)
+            add(before, (constants.SEARCH,))
+            add(hit, (constants.SEARCH, constants.HIGHLIGHT))
+            add(after, (constants.SEARCH,))
+            self.intervals[constants.SEARCH].append(
+                (begin, offset, (text, chars, first, last))
+            )
+            add("\n")
+            self.shown += 1
+            number += 1
+            if number == len(found):
+                add("\n")
+                index += 1
+                number = 0
+        self.position = (index, number)
+        remaining = self.total - self.shown
+        if remaining > 0:
+            add(f"{Tr('Show more hits')} ({remaining})", (constants.SEARCH_MORE,))
+        if insert:
+            self.view.insert(tk.INSERT, *insert)
 
     def xref_enter(self, event):
-        self.view.configure(cursor=contants.XREF_CURSOR)
+        self.view.configure(cursor=constants.XREF_CURSOR)
 
     def xref_leave(self, event):
         self.view.configure(cursor="")
 
-    def xref_action(self, event=None, text=None, first=None, last=None):
+    def xref_action(self, event=None):
+        "Show the text, and highlight the hit clicked on."
+        hit = self.get_interval(constants.SEARCH)
+        if hit is None:
+            return
+        text, chars, first, last = hit
+        astral = self.view.tk.call("string", "length", "\U0001f600") == 2
         self.main.texts_notebook.select(text.tabid)
-        text.viewer.highlight(first=first, last=last)
+        text.viewer.highlight(
+            first=self.get_index(text, chars, first, astral),
+            last=self.get_index(text, chars, last, astral),
+        )
+
+    def save_index(self):
+        """Save the index for the next session, when closing; ignore any error.
+        Any search in progress is cancelled.
+        """
+        self.generation += 1
+        with self.index_lock:
+            self.index.prune()
+            try:
+                self.index.save()
+            except OSError:
+                pass
 
     def clear(self):
+        "Clear the term and the results, cancelling any search in progress."
+        self.generation += 1
+        self.query = None
         self.result = []
+        self.total = 0
         self.search_entry.delete(0, tk.END)
         self.display()
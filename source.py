@@ -2,32 +2,56 @@
 
 from icecream import ic
 
-import datetime
+import concurrent.futures
+import hashlib
+import multiprocessing
 import os
+import pickle
 import re
 import shutil
+import sys
 import tarfile
 import time
+import uuid
 
 import marko
 import marko.ast_renderer
 import marko.inline
 import marko.helpers
 import marko.ext.gfm
-import yaml
 
 import constants
+import frontmatter
 
 FRONTMATTER = re.compile(r"^---([\n\r].*?[\n\r])---[\n\r](.*)$", re.DOTALL)
 
+# Directories in the source that do not contain texts of the source.
+SPECIAL_DIRNAMES = (constants.ARCHIVE_DIRNAME, constants.REFERENCES_DIRNAME)
+
+# Change whenever the format of the cached data changes.
+CACHE_VERSION = (constants.__version__, marko.__version__, 4)
+
+# Keys in the ASTRenderer output that are not used, and not kept in the AST.
+UNUSED_AST_KEYS = frozenset(["inline_body", "escape", "footnotes", "link_ref_defs"])
+
 
 class Source:
     "Tree of source Markdown texts in files and directories."
 
-    def __init__(self, absdirpath):
+    def __init__(self, absdirpath, cache=True, workers=None):
         self.absdirpath = absdirpath
         self.name = os.path.basename(absdirpath)
         self.display_heading_ordinal = False
+        self.workers = workers
+        # Incremented whenever the structure of the tree changes.
+        self.version = 0
+        self._order = None
+        if cache:
+            self.cache = ParseCache(
+                absdirpath, os.path.join(absdirpath, constants.CACHE_FILENAME)
+            )
+        else:
+            self.cache = ParseCache(absdirpath)
         self.read()
 
     def __str__(self):
@@ -51,6 +75,11 @@ class Source:
     def fullname(self):
         return ""
 
+    @property
+    def id(self):
+        "The source itself is the root of the tree; its identifier is empty."
+        return ""
+
     @property
     def parent(self):
         return None
@@ -65,19 +94,71 @@ class Source:
 
     @property
     def all_items(self):
-        "Return list of all sub-items. Self is *not* included."
-        result = []
-        for item in self.items:
-            result.append(item)
-            result.extend(item.all_items)
-        return result
+        "Return tuple of all sub-items in preorder. Self is *not* included."
+        return self.get_order(self)[0]
 
     @property
     def all_texts(self):
-        "Return list of all sub-items that are texts."
-        result = []
-        for item in self.items:
-            result.extend(item.all_texts)
+        "Return tuple of all sub-items that are texts."
+        return self.get_order(self)[1]
+
+    def changed(self):
+        "The structure of the tree has changed. Discard the cached item order."
+        self.version += 1
+        self._order = None
+
+    @property
+    def order(self):
+        """Data on the current structure of the tree: the item order, numbering,
+        and lookups by fullname and identifier. Computed anew after each change.
+        """
+        if self._order is None:
+            items = []
+            texts = []
+            spans = {}
+            preorder(self, items, texts, spans)
+            items = tuple(items)
+            texts = tuple(texts)
+            numbers = numbering(self)
+            self._order = dict(
+                spans=spans,
+                slices={self: (items, texts)},
+                numbers=numbers,
+                headings={},
+                lookup=dict([(n[3], i) for i, n in numbers.items()]),
+                ids=dict([(i.id, i) for i in items]),
+            )
+        return self._order
+
+    @property
+    def lookup(self):
+        "Lookup of items by fullname."
+        return self.order["lookup"]
+
+    @property
+    def ids(self):
+        "Lookup of items by identifier."
+        return self.order["ids"]
+
+    def get_order(self, section):
+        """Return the tuples of all sub-items and all texts of the given section
+        in preorder. The slices for a section are memoized until the next change.
+        """
+        order = self.order
+        try:
+            return order["slices"][section]
+        except KeyError:
+            pass
+        try:
+            start, end, tstart, tend = order["spans"][section]
+        except KeyError:  # Not in the tree (yet); compute directly.
+            items = []
+            texts = []
+            preorder(section, items, texts, {})
+            return tuple(items), tuple(texts)
+        all_items, all_texts = order["slices"][self]
+        result = (all_items[start:end], all_texts[tstart:tend])
+        order["slices"][section] = result
         return result
 
     @property
@@ -85,31 +166,80 @@ class Source:
         return False
 
     def read(self):
-        self.items = []
-
+        self.cache.accessed = set()
         # Section and Text instances for directories and files that actually exist.
-        for itemname in sorted(os.listdir(self.absdirpath)):
-            # Skip hard-wired special directories.
-            if itemname == constants.ARCHIVE_DIRNAME:
-                continue
-            if itemname == constants.REFERENCES_DIRNAME:
-                continue
-
-            itempath = os.path.join(self.absdirpath, itemname)
-            if os.path.isdir(itempath):
-                self.items.append(Section(self, self, itemname))
-            elif itemname.endswith(constants.MARKDOWN_EXT):
-                self.items.append(Text(self, self, itemname))
-            else:
-                pass
+        # Skip hard-wired special directories.
+        read_items(self, self, skip=SPECIAL_DIRNAMES)
+        self.changed()
+
+        # Forget files that no longer exist, and save any new entries.
+        self.cache.prune()
+        self.save_cache()
+
+    def preload(self):
+        """Parse the Markdown content of all texts that have not yet been parsed.
+        Done in parallel when worthwhile; to be used before accessing all ASTs.
+        The summaries of the texts are set from the entries thus obtained.
+        """
+        self.cache.preload(
+            [t.abspath for t in self.all_texts if t._ast is None], workers=self.workers
+        )
+        for text in self.all_texts:
+            if text._summary is None:
+                text._summary = self.cache.get_summary(text.abspath, text.stat[2])
 
-        self.lookup = {}
-        for item in self.all_items:
-            self.lookup[item.fullname] = item
+    @property
+    def summarized(self):
+        "Are the summaries of all texts available without parsing any content?"
+        return all([t.summarized for t in self.all_texts])
+
+    def refresh(self):
+        """Pick up changes made to the files and directories outside of Au.
+        Only directories whose modification time has changed are listed anew,
+        and only texts whose file has changed are read anew.
+        Return a Changeset of the added, removed and modified items.
+        """
+        changeset = Changeset()
+        refresh_items(self, self, changeset, skip=SPECIAL_DIRNAMES)
+        if changeset.added or changeset.removed:
+            self.changed()
+        self.save_cache()
+        return changeset
+
+    def save_cache(self):
+        "Save the parse cache, if it has been modified. Ignore any error."
+        try:
+            self.cache.save()
+        except OSError:
+            pass
 
     def get(self, fullname, default=None):
         return self.lookup.get(fullname, default)
 
+    def get_numbering(self, item):
+        """Return the tuple (index, ordinal, level, fullname) for the item.
+        Computed for all items at once, and cached until the next change.
+        """
+        try:
+            return self.order["numbers"][item]
+        except KeyError:  # Not in the tree (yet); compute directly.
+            return item_numbering(item)
+
+    def get_heading(self, item):
+        "Return the heading for the item, memoized until the next change."
+        key = (item, self.display_heading_ordinal)
+        try:
+            return self.order["headings"][key]
+        except KeyError:
+            pass
+        if self.display_heading_ordinal:
+            result = f'{".".join([str(i) for i in item.ordinal])}. {item.name}'
+        else:
+            result = item.name
+        if item in self.order["numbers"]:
+            self.order["headings"][key] = result
+        return result
+
     def get_config(self):
         return dict(items=[i.get_config() for i in self.items])
 
@@ -125,6 +255,14 @@ class Source:
                 self.items.append(item)
                 item.apply_config(ordered)
         self.items.extend(original.values())
+        self.changed()
+        # Guard against duplicated identifiers in an edited configuration.
+        ids = set()
+        for item in self.all_items:
+            if item.id in ids:
+                item.id = uuid.uuid4().hex
+            ids.add(item.id)
+        self.changed()
 
     def create_text(self, name, anchor=None):
         """Create a new empty text inside the anchor if it is a section,
@@ -151,7 +289,7 @@ class Source:
             section.items.insert(anchor.index + 1, new)
         else:
             section.items.append(new)
-        self.lookup[new.fullname] = new
+        self.changed()
         return new
 
     def create_section(self, anchor, name):
@@ -174,7 +312,7 @@ class Source:
             section.items.insert(anchor.index + 1, new)
         else:
             section.items.append(new)
-        self.lookup[new.fullname] = new
+        self.changed()
         return new
 
     def archive(self, sources=None):
@@ -199,7 +337,12 @@ class Source:
                 if not isinstance(sources, list):
                     sources = [sources]
                 for source in sources:
-                    archivefile.add(source.abspath, arcname=source.name, recursive=True)
+                    archivefile.add(
+                        source.abspath,
+                        arcname=source.name,
+                        recursive=True,
+                        filter=exclude_cache,
+                    )
         with tarfile.open(archivefilepath) as archivefile:
             result = len(archivefile.getnames())
         return archivefilepath, result
@@ -207,6 +350,7 @@ class Source:
     def check_integrity(self):
         assert os.path.exists(self.abspath), (self, self.abspath)
         assert os.path.isdir(self.abspath), (self, self.abspath)
+        assert len(self.ids) == len(self.all_items), (self, "duplicate identifiers")
         assert len(self.lookup) == len(self.all_items), (
             ic(
                 len(self.lookup),
@@ -215,8 +359,14 @@ class Source:
                 self.all_items,
             ),
         )
+        items = []
+        texts = []
+        preorder(self, items, texts, {})
+        assert self.all_items == tuple(items), (self, "stale item order")
+        assert self.all_texts == tuple(texts), (self, "stale text order")
         for item in self.all_items:
             assert item.source is self, (self, item)
+            assert item.numbering == item_numbering(item), (item, "stale numbering")
             assert isinstance(item, Text) or isinstance(item, Section), (self, item)
             item.check_integrity()
         for text in self.all_texts:
@@ -227,10 +377,14 @@ class Source:
 class Item:
     "Abstract class for sections and texts."
 
+    __slots__ = ("source", "parent", "name", "id")
+
     def __init__(self, source, parent, name):
         self.source = source
         self.parent = parent
         self.name = name
+        # Identifier that is independent of the name and position of the item.
+        self.id = uuid.uuid4().hex
         self.read()
 
     def __str__(self):
@@ -239,21 +393,20 @@ class Item:
     def __repr__(self):
         return f"{self.__class__.__name__}('{self.fullname}')"
 
+    @property
+    def numbering(self):
+        "Tuple (index, ordinal, level, fullname) for the item."
+        if self.source is None:  # Deleted item.
+            return item_numbering(self)
+        return self.source.get_numbering(self)
+
     @property
     def fullname(self):
-        if self.parent is self.source:
-            return self.name
-        else:
-            return os.path.join(self.parent.fullname, self.name)
+        return self.numbering[3]
 
     @property
     def level(self):
-        result = 0
-        parent = self.parent
-        while parent is not None:
-            result += 1
-            parent = parent.parent
-        return result
+        return self.numbering[2]
 
     @property
     def is_text(self):
@@ -266,27 +419,17 @@ class Item:
     @property
     def index(self):
         "The index of this item among its siblings."
-        for result, item in enumerate(self.parent.items):
-            if item is self:
-                return result
+        return self.numbering[0]
 
     @property
     def ordinal(self):
         "Tuple of parent's and its own index for sorting purposes."
-        result = [self.index + 1]
-        parent = self.parent
-        while parent is not self.source:
-            result.append(parent.index + 1)
-            parent = parent.parent
-        return tuple(reversed(result))
+        return self.numbering[1]
 
     @property
     def heading(self):
         "Return heading, containing ordinal if so set, and name of this item."
-        if self.source.display_heading_ordinal:
-            return f'{".".join([str(i) for i in self.ordinal])}. {self.name}'
-        else:
-            return self.name
+        return self.source.get_heading(self)
 
     @property
     def prev(self):
@@ -327,32 +470,6 @@ class Item:
     def abspath(self):
         return os.path.join(self.parent.abspath, self.filename())
 
-    @property
-    def age(self):
-        "Get the age of the file."
-        now = datetime.datetime.today()
-        modified = datetime.datetime.fromtimestamp(os.path.getmtime(self.abspath))
-        age = now - modified
-        if age.days >= 365.25:
-            value = age.days / 365.25
-            unit = "yrs"
-        elif age.days >= 30.5:
-            value = age.days / 30.5
-            unit = "mths"
-        elif age.days >= 1:
-            value = age.days + age.seconds / 86400.0
-            unit = "days"
-        elif age.seconds >= 3600.0:
-            value = age.seconds / 3600.0
-            unit = "hrs"
-        elif age.seconds >= 60.0:
-            value = age.seconds / 60.0
-            unit = "mins"
-        else:
-            value = age.seconds + age.microseconds / 1000000.0
-            unit = "secs"
-        return f"{value:.0f} {unit}"
-
     @property
     def is_shown(self):
         "Are all parent sections open?"
@@ -387,16 +504,10 @@ class Item:
         newabspath = os.path.join(self.parent.abspath, self.filename(newname))
         if os.path.exists(newabspath):
             raise ValueError("The name is already in use.")
-        oldfullnames = [self.fullname] + [i.fullname for i in self.all_items]
         oldabspath = self.abspath
         self.name = newname
         os.rename(oldabspath, self.abspath)
-        self.replace_in_lookup(oldfullnames)
-
-    def replace_in_lookup(self, oldfullnames):
-        for oldfullname in oldfullnames:
-            item = self.source.lookup.pop(oldfullname)
-            self.source.lookup[item.fullname] = item
+        self.source.changed()
 
     def move_up(self):
         """Move this item one step towards the beginning of its list of sibling items.
@@ -406,6 +517,7 @@ class Item:
         if pos == 0:
             raise ValueError("Item already at the start of the list.")
         self.parent.items.insert(pos - 1, self.parent.items.pop(pos))
+        self.source.changed()
 
     def move_down(self):
         """Move this item one step down towards the end of its list of sibling items.
@@ -415,6 +527,7 @@ class Item:
         if pos == len(self.parent.items) - 1:
             raise ValueError("Item already at the end of the list.")
         self.parent.items.insert(pos + 1, self.parent.items.pop(pos))
+        self.source.changed()
 
     def move_to_parent(self):
         """Move this item one level up to the parent.
@@ -427,7 +540,6 @@ class Item:
         if os.path.exists(newabspath):
             raise ValueError("Item cannot be moved up due to name collision.")
         oldabspath = self.abspath
-        oldfullnames = [self.fullname] + [i.fullname for i in self.all_items]
         before = self.parent.next
         self.parent.items.remove(self)
         if before:
@@ -436,7 +548,7 @@ class Item:
             self.parent.parent.items.append(self)
         self.parent = self.parent.parent
         os.rename(oldabspath, self.abspath)
-        self.replace_in_lookup(oldfullnames)
+        self.source.changed()
 
     def move_to_section(self, section):
         """Move this item one level down to the given section.
@@ -451,12 +563,11 @@ class Item:
         if os.path.exists(newabspath):
             raise ValueError("Item cannot be moved down due to name collision.")
         oldabspath = self.abspath
-        oldfullnames = [self.fullname] + [i.fullname for i in self.all_items]
         self.parent.items.remove(self)
         section.items.append(self)
         self.parent = section
         os.rename(oldabspath, self.abspath)
-        self.replace_in_lookup(oldfullnames)
+        self.source.changed()
 
     def copy(self, newname):
         "Common code for section and text copy operations."
@@ -478,12 +589,15 @@ class Item:
         assert isinstance(self.source, Source), self
         assert self in self.parent.items, self
         assert self.fullname in self.source.lookup, self
+        assert self.source.ids[self.id] is self, self
         assert os.path.exists(self.abspath), self
 
 
 class Section(Item):
     "Directory."
 
+    __slots__ = ("items", "open", "mtime")
+
     def __init__(self, source, parent, name):
         self.items = []
         self.open = False
@@ -495,20 +609,13 @@ class Section(Item):
 
     @property
     def all_items(self):
-        "Return list of all sub-items. Self is not included."
-        result = []
-        for item in self.items:
-            result.append(item)
-            result.extend(item.all_items)
-        return result
+        "Return tuple of all sub-items in preorder. Self is not included."
+        return self.source.get_order(self)[0]
 
     @property
     def all_texts(self):
-        "Return list of all sub-items that are texts."
-        result = []
-        for item in self.items:
-            result.extend(item.all_texts)
-        return result
+        "Return tuple of all sub-items that are texts."
+        return self.source.get_order(self)[1]
 
     def filename(self, newname=None):
         if newname:
@@ -517,25 +624,20 @@ class Section(Item):
             return self.name
 
     def read(self):
-        for itemname in sorted(os.listdir(self.abspath)):
-            itempath = os.path.join(self.abspath, itemname)
-            if os.path.isdir(itempath):
-                self.items.append(Section(self.source, self, itemname))
-            elif itemname.endswith(constants.MARKDOWN_EXT):
-                self.items.append(Text(self.source, self, itemname))
-            else:
-                pass
+        read_items(self.source, self)
 
     def get_config(self):
         return dict(
             type="section",
             name=self.name,
+            id=self.id,
             open=self.open,
             items=[i.get_config() for i in self.items],
         )
 
     def apply_config(self, config):
         assert config["type"] == "section"
+        self.id = config.get("id") or self.id
         self.open = bool(config.get("open"))
         original = dict([(i.name, i) for i in self.items])
         self.items = []
@@ -554,17 +656,13 @@ class Section(Item):
         shutil.copytree(self.abspath, newabspath)
         new = Section(self.source, self.parent, newname)
         self.parent.items.append(new)
-        self.source.lookup[new.fullname] = new
-        for item in new.all_items:
-            self.source.lookup[item.fullname] = item
+        self.source.changed()
         return new
 
     def delete(self):
         shutil.rmtree(self.abspath)
-        for item in self.all_items:
-            self.source.lookup.pop(item.fullname)
-        self.source.lookup.pop(self.fullname)
         self.parent.items.remove(self)
+        self.source.changed()
         self.source = None
         self.parent = None
 
@@ -576,9 +674,14 @@ class Section(Item):
 class Text(Item):
     "Markdown file."
 
+    # The viewer and tabid are set by the main window.
+    __slots__ = ("frontmatter", "stat", "_ast", "_summary", "viewer", "tabid")
+
     def __init__(self, source, parent, name):
         name, ext = os.path.splitext(name)
         assert not ext or ext == constants.MARKDOWN_EXT
+        self._ast = None
+        self._summary = None
         super().__init__(source, parent, name)
 
     def __len__(self):
@@ -596,13 +699,13 @@ class Text(Item):
 
     @property
     def all_items(self):
-        "Return list of all sub-items. Self is *not* included."
-        return []
+        "Return tuple of all sub-items. Self is *not* included."
+        return ()
 
     @property
     def all_texts(self):
-        "Return list of all sub-items that are texts. Self *is* included."
-        return [self]
+        "Return tuple of all sub-items that are texts. Self *is* included."
+        return (self,)
 
     def get(self, key, default=None):
         try:
@@ -633,35 +736,75 @@ class Text(Item):
         else:
             return self.name + constants.MARKDOWN_EXT
 
+    @property
+    def ast(self):
+        "The AST of the Markdown content; parsed when first accessed."
+        if self._ast is None:
+            self._ast = self.source.cache.get_ast(self.abspath)
+        return self._ast
+
+    @property
+    def summary(self):
+        """The number of characters in the content, and the number of occurrences
+        of each indexed term and reference; obtained from the cache if possible.
+        """
+        if self._summary is None:
+            self._summary = self.source.cache.get_entry(self.abspath, ast=True)[5]
+        return self._summary
+
+    @property
+    def summarized(self):
+        "Is the summary available without parsing the content?"
+        return self._summary is not None
+
+    @property
+    def length(self):
+        "Number of characters in the content."
+        return self.summary[0]
+
+    @property
+    def indexed(self):
+        "Number of occurrences of each indexed term; key: canonical term."
+        return self.summary[1]
+
+    @property
+    def references(self):
+        "Number of occurrences of each reference; key: reference id."
+        return self.summary[2]
+
+    def invalidate(self):
+        "The AST and summary must be obtained anew when next accessed."
+        self._ast = None
+        self._summary = None
+
     def read(self):
-        with open(self.abspath) as infile:
-            content = infile.read()
-        match = FRONTMATTER.match(content)
-        if match:
-            self.frontmatter = yaml.safe_load(match.group(1))
-            content = content[match.start(2) :]
-        else:
-            self.frontmatter = {}
-        self.ast = parser.convert(content)
+        "Read the frontmatter. The Markdown content is parsed only when required."
+        entry = self.source.cache.get_entry(self.abspath)
+        self.frontmatter = pickle.loads(entry[3])
+        # The modification time, size and digest of the file when read.
+        self.stat = entry[:3]
+        self.invalidate()
+        self._summary = entry[5]
 
     def get_config(self):
-        return dict(type="text", name=self.name, status=repr(self.status))
+        return dict(type="text", name=self.name, id=self.id, status=repr(self.status))
 
     def apply_config(self, config):
         assert config["type"] == "text"
+        self.id = config.get("id") or self.id
 
     def copy(self, newname):
         newabspath = super().copy(newname)
         shutil.copy2(self.abspath, newabspath)
         new = Text(self.source, self.parent, newname + constants.MARKDOWN_EXT)
         self.parent.items.append(new)
-        self.source.lookup[new.fullname] = new
+        self.source.changed()
         return new
 
     def delete(self):
         os.remove(self.abspath)
-        self.source.lookup.pop(self.fullname)
         self.parent.items.remove(self)
+        self.source.changed()
         self.source = None
         self.parent = None
 
@@ -673,7 +816,7 @@ class Text(Item):
         """
         with open(self.abspath, "w") as outfile:
             outfile.write("---\n")
-            outfile.write(yaml.dump(self.frontmatter))
+            outfile.write(frontmatter.dump(self.frontmatter))
             outfile.write("---\n")
             prev_empty = False
             for line in content.split("\n"):
@@ -690,6 +833,83 @@ class Text(Item):
         assert os.path.isfile(self.abspath)
 
 
+class Node:
+    """Compact node of the AST of a text. The children are a tuple of nodes,
+    or a string. Other attributes are kept in a dictionary, which is shared
+    between identical nodes in a text. Access by key as in the dictionaries
+    produced by the marko ASTRenderer.
+    """
+
+    __slots__ = ("element", "children", "attrs")
+
+    def __init__(self, element, children=None, attrs=None):
+        self.element = element
+        self.children = children
+        self.attrs = attrs
+
+    def __repr__(self):
+        return f"Node({self.element!r}, {self.children!r}, {self.attrs!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return NotImplemented
+        return (self.element, self.children, self.attrs) == (
+            other.element,
+            other.children,
+            other.attrs,
+        )
+
+    def __reduce__(self):
+        "Pickle compactly, without the names of the slots."
+        return (Node, (self.element, self.children, self.attrs))
+
+    def __getitem__(self, key):
+        if key == "element":
+            return self.element
+        elif key == "children":
+            if self.children is None:
+                raise KeyError(key)
+            return self.children
+        elif self.attrs is None:
+            raise KeyError(key)
+        else:
+            return self.attrs[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Changeset:
+    "The items added, removed and modified when refreshing a source."
+
+    def __init__(self):
+        # Added and removed sections are followed by all their sub-items.
+        self.added = []
+        self.removed = []
+        self.modified = []  # Texts only.
+        # Key: text id; value: summary before modification, if it was known.
+        self.summaries = {}
+
+    def __repr__(self):
+        return (
+            f"Changeset(added={len(self.added)}, removed={len(self.removed)},"
+            f" modified={len(self.modified)})"
+        )
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+
 class Indexed(marko.inline.InlineElement):
     "Markdown extension for indexed term."
 
@@ -714,18 +934,399 @@ class Reference(marko.inline.InlineElement):
         self.reference = match.group(1).strip()
 
 
-parser = marko.Markdown(renderer=marko.ast_renderer.ASTRenderer)
-parser.use("footnote")
-parser.use(
-    marko.helpers.MarkoExtension(
-        elements=[
-            marko.ext.gfm.elements.Table,
-            marko.ext.gfm.elements.TableRow,
-            marko.ext.gfm.elements.TableCell,
+class ParseCache:
+    """Persistent cache of the frontmatter and AST of the Markdown files in a source.
+    An entry is valid if the modification time and size of its file are unchanged.
+    Otherwise the content hash is compared, and the file is parsed only if it differs.
+    """
+
+    def __init__(self, absdirpath, filepath=None):
+        self.absdirpath = absdirpath
+        self.filepath = filepath
+        # Key: relative filepath; value: (mtime, size, digest, pickled frontmatter,
+        #                                 pickled AST or None, summary or None)
+        self.entries = {}
+        self.accessed = set()
+        self.modified = False
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        "Load the cache file, if any. An invalid or outdated file is ignored."
+        if not self.filepath:
+            return
+        try:
+            with open(self.filepath, "rb") as infile:
+                data = pickle.load(infile)
+            if data["version"] != CACHE_VERSION:
+                raise ValueError
+            self.entries = data["entries"]
+        except (
+            OSError,
+            EOFError,
+            pickle.UnpicklingError,
+            KeyError,
+            TypeError,
+            ValueError,
+        ):
+            self.entries = {}
+
+    def save(self):
+        "Save the cache file, if modified. Raise OSError if any problem."
+        if not self.filepath or not self.modified:
+            return
+        tmpfilepath = self.filepath + ".tmp"
+        with open(tmpfilepath, "wb") as outfile:
+            pickle.dump(
+                dict(version=CACHE_VERSION, entries=self.entries),
+                outfile,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmpfilepath, self.filepath)
+        self.modified = False
+
+    def prune(self):
+        "Remove entries for files that have not been accessed since the last read."
+        for key in set(self.entries).difference(self.accessed):
+            self.entries.pop(key)
+            self.modified = True
+
+    def preload(self, abspaths, workers=None):
+        """Parse those of the given Markdown files that have not been parsed,
+        or have changed, using a pool of processes, and store the results.
+        If only a few files need parsing, do nothing; they will be parsed
+        serially when their ASTs are accessed.
+        """
+        stale = []
+        for abspath in abspaths:
+            key = os.path.relpath(abspath, self.absdirpath)
+            stat = os.stat(abspath)
+            entry = self.entries.get(key)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                if entry[4] is not None:
+                    continue
+            with open(abspath) as infile:
+                content = infile.read()
+            digest = get_digest(content)
+            if entry and entry[2] == digest and entry[4] is not None:
+                self.entries[key] = (stat.st_mtime_ns, stat.st_size, digest) + entry[3:]
+                self.modified = True
+            else:
+                stale.append((key, stat, digest, content))
+        if len(stale) < constants.PARSE_PARALLEL_MINIMUM:
+            return
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            return
+        chunksize = len(stale) // (4 * workers) + 1
+        # Spawned processes are safe also when Tk is running in this process.
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results = executor.map(
+                parse_pickled, [s[3] for s in stale], chunksize=chunksize
+            )
+            for (key, stat, digest, content), data in zip(stale, results):
+                self.entries[key] = (stat.st_mtime_ns, stat.st_size, digest) + data
+        self.modified = True
+
+    def get_summary(self, abspath, digest):
+        """Return the summary for the given Markdown file, if its entry is for
+        the content with the given digest and has been parsed, else None.
+        """
+        entry = self.entries.get(os.path.relpath(abspath, self.absdirpath))
+        if entry and entry[2] == digest:
+            return entry[5]
+        return None
+
+    def get_ast(self, abspath):
+        "Return the AST of the Markdown content of the given file."
+        return pickle.loads(self.get_entry(abspath, ast=True)[4])
+
+    def get_entry(self, abspath, ast=False):
+        """Return the entry for the given Markdown file. The file is read
+        and parsed only if it has changed, or if its AST is required
+        but has not yet been parsed.
+        """
+        key = os.path.relpath(abspath, self.absdirpath)
+        self.accessed.add(key)
+        stat = os.stat(abspath)
+        entry = self.entries.get(key)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            if not ast or entry[4] is not None:
+                return entry
+        with open(abspath) as infile:
+            content = infile.read()
+        digest = get_digest(content)
+        if entry and entry[2] == digest and (not ast or entry[4] is not None):
+            entry = (stat.st_mtime_ns, stat.st_size, digest) + entry[3:]
+        else:
+            frontmatter, content = parse_frontmatter(content)
+            if ast:
+                data = convert(content)
+                summary = summarize(data)
+                data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            else:
+                data = None
+                summary = None
+            entry = (
+                stat.st_mtime_ns,
+                stat.st_size,
+                digest,
+                pickle.dumps(frontmatter, pickle.HIGHEST_PROTOCOL),
+                data,
+                summary,
+            )
+        self.entries[key] = entry
+        self.modified = True
+        return entry
+
+
+def scan(dirpath, skip=()):
+    """Return the modification time of the directory, and the sorted list
+    of (name, is_dir) for its subdirectories and Markdown files.
+    """
+    entries = []
+    with os.scandir(dirpath) as scanner:
+        for entry in scanner:
+            if entry.name in skip:
+                continue
+            if entry.is_dir():
+                entries.append((entry.name, True))
+            elif entry.name.endswith(constants.MARKDOWN_EXT):
+                entries.append((entry.name, False))
+    entries.sort()
+    return os.stat(dirpath).st_mtime_ns, entries
+
+
+def read_items(source, section, skip=()):
+    "Create the items for the subdirectories and Markdown files of the section."
+    section.mtime, entries = scan(section.abspath, skip=skip)
+    section.items = []
+    for name, is_dir in entries:
+        if is_dir:
+            section.items.append(Section(source, section, name))
+        else:
+            section.items.append(Text(source, section, name))
+
+
+def refresh_items(source, section, changeset, skip=()):
+    """Update the items of the section, and recursively its subsections,
+    from the files and directories, and record the changes.
+    """
+    added = []
+    if os.stat(section.abspath).st_mtime_ns != section.mtime:
+        section.mtime, entries = scan(section.abspath, skip=skip)
+        current = set([name for name, is_dir in entries])
+        for item in list(section.items):
+            if item.filename() not in current:
+                section.items.remove(item)
+                changeset.removed.append(item)
+                if item.is_section:
+                    preorder(item, changeset.removed, [], {})
+        existing = set([i.filename() for i in section.items])
+        for name, is_dir in entries:
+            if name in existing:
+                continue
+            if is_dir:
+                item = Section(source, section, name)
+            else:
+                item = Text(source, section, name)
+            section.items.append(item)
+            added.append(item)
+            changeset.added.append(item)
+            if item.is_section:
+                preorder(item, changeset.added, [], {})
+    for item in section.items:
+        if item in added:  # Just read.
+            continue
+        if item.is_section:
+            refresh_items(source, item, changeset)
+        else:
+            stat = os.stat(item.abspath)
+            if item.stat[:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            digest = item.stat[2]
+            summary = item.summary if item.summarized else None
+            item.read()
+            if item.stat[2] != digest:
+                changeset.modified.append(item)
+                changeset.summaries[item.id] = summary
+
+
+def preorder(section, items, texts, spans):
+    """Append the sub-items and texts of the section in preorder to the lists.
+    Record the span of each sub-section in the lists.
+    """
+    for item in section.items:
+        items.append(item)
+        if item.is_text:
+            texts.append(item)
+        else:
+            start = len(items)
+            tstart = len(texts)
+            preorder(item, items, texts, spans)
+            spans[item] = (start, len(items), tstart, len(texts))
+
+
+def numbering(source):
+    """Return a dictionary with the tuple (index, ordinal, level, fullname)
+    for each item in the source.
+    """
+    result = {}
+    stack = [(source, (), 0, "")]
+    while stack:
+        section, ordinal, level, fullname = stack.pop()
+        for index, item in enumerate(section.items):
+            number = (
+                index,
+                ordinal + (index + 1,),
+                level + 1,
+                os.path.join(fullname, item.name) if fullname else item.name,
+            )
+            result[item] = number
+            if item.is_section:
+                stack.append((item, *number[1:]))
+    return result
+
+
+def item_numbering(item):
+    "Return the tuple (index, ordinal, level, fullname) computed directly."
+    if item.parent is None:  # Deleted item.
+        return (None, None, 0, item.name)
+    if item.parent is item.source:
+        fullname = item.name
+    else:
+        fullname = os.path.join(item.parent.fullname, item.name)
+    for index, sibling in enumerate(item.parent.items):
+        if sibling is item:
+            break
+    else:
+        index = None  # Not yet among the items of the parent.
+    level = 0
+    parent = item.parent
+    while parent is not None:
+        level += 1
+        parent = parent.parent
+    if index is None:
+        ordinal = None
+    else:
+        ordinal = (item.parent.ordinal if item.parent is not item.source else ()) + (
+            index + 1,
+        )
+    return (index, ordinal, level, fullname)
+
+
+def parse_pickled(content):
+    """Return the pickled frontmatter and AST, and the summary, of the Markdown
+    content. Executed by the worker processes when loading a source in parallel.
+    """
+    frontmatter, content = parse_frontmatter(content)
+    ast = convert(content)
+    return (
+        pickle.dumps(frontmatter, pickle.HIGHEST_PROTOCOL),
+        pickle.dumps(ast, pickle.HIGHEST_PROTOCOL),
+        summarize(ast),
+    )
+
+
+def summarize(ast):
+    """Return the number of characters in the content of the AST, and dictionaries
+    of the number of occurrences of each indexed term and reference.
+    """
+    length = 0
+    indexed = {}
+    references = {}
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if isinstance(node.children, str):
+            length += len(node.children)
+        elif node.children:
+            stack.extend(node.children)
+        elif node.element == "indexed":
+            length += len(node["term"])
+            indexed[node["canonical"]] = indexed.get(node["canonical"], 0) + 1
+        elif node.element == "reference":
+            length += len(node["reference"])
+            references[node["reference"]] = references.get(node["reference"], 0) + 1
+    return (length, indexed, references)
+
+
+def get_digest(content):
+    "Return the digest of the content of a Markdown file."
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def convert(content, markdown=None):
+    """Return the compact AST for the Markdown content. A parser which is not
+    shared must be given if this is done in a separate thread.
+    """
+    return compact((markdown or parser).convert(content), {})
+
+
+def compact(ast, attrs_pool):
+    "Convert the ASTRenderer dictionary to a compact node, recursively."
+    children = ast.get("children")
+    if isinstance(children, list):
+        children = tuple([compact(c, attrs_pool) for c in children])
+    attrs = dict(
+        [
+            (k, v)
+            for k, v in ast.items()
+            if k not in ("element", "children") and k not in UNUSED_AST_KEYS
         ]
     )
-)
-parser.use(marko.helpers.MarkoExtension(elements=[Indexed, Reference]))
+    if attrs:
+        key = tuple(sorted(attrs.items()))
+        try:
+            attrs = attrs_pool.setdefault(key, attrs)
+        except TypeError:  # Unhashable attribute value; do not share.
+            pass
+    else:
+        attrs = None
+    return Node(sys.intern(ast["element"]), children, attrs)
+
+
+def parse_frontmatter(content):
+    "Return the frontmatter and the remaining Markdown content."
+    match = FRONTMATTER.match(content)
+    if match:
+        return frontmatter.load(match.group(1)), content[match.start(2) :]
+    else:
+        return {}, content
+
+
+def get_parser():
+    "Return a Markdown parser with the extensions used for the texts."
+    result = marko.Markdown(renderer=marko.ast_renderer.ASTRenderer)
+    result.use("footnote")
+    result.use(
+        marko.helpers.MarkoExtension(
+            elements=[
+                marko.ext.gfm.elements.Table,
+                marko.ext.gfm.elements.TableRow,
+                marko.ext.gfm.elements.TableCell,
+            ]
+        )
+    )
+    result.use(marko.helpers.MarkoExtension(elements=[Indexed, Reference]))
+    return result
+
+
+parser = get_parser()
+
+
+def exclude_cache(tarinfo):
+    "Filter for tar archiving; exclude the parse cache and search index files."
+    if os.path.basename(tarinfo.name) in (
+        constants.CACHE_FILENAME,
+        constants.SEARCH_INDEX_FILENAME,
+    ):
+        return None
+    return tarinfo
 
 
 def check_invalid_characters(name):
@@ -63,7 +63,7 @@ class TextEditor(Editor):
 
     def get_cursor(self):
         "Get the position of cursor in absolute number of characters."
-        return len(self.view.get("1.0", tk.INSERT))
+        return self.count("1.0", tk.INSERT)
 
     def set_cursor(self, position):
         "Set the position of the cursor by the absolute number of characters."
@@ -2,6 +2,8 @@
 
 from icecream import ic
 
+import functools
+
 import tkinter as tk
 
 import constants
@@ -11,43 +13,60 @@ from viewer import Viewer
 
 
 class TextViewer(Viewer):
-    "Viewer window for Markdown text file."
+    """Viewer window for Markdown text file.
+    Only the frame is created initially. The 'view' tk.Text instance is created
+    and the text rendered when it is first displayed.
+    """
 
     TEXT_COLOR = constants.TEXT_COLOR
 
     def __init__(self, parent, main, text):
-        super().__init__(parent, main)
+        self.main = main
         self.text = text
+        self.view = None
+        # Cursor position and scroll state until the view is created.
+        self.saved_cursor = 0
+        self.saved_yview = None
+        self.view_frame_create(parent)
 
     def __str__(self):
         "The full name of the text; filepath excluding extension."
         return self.text.fullname
 
     def __len__(self):
-        "Number of characters."
-        return len(self.view.get("1.0", tk.END)) - self.heading_offset
+        "Number of characters; of the content of the text, if not displayed."
+        if self.view is None:
+            return self.text.length
+        return super().__len__() - self.heading_offset
 
     @property
     def section(self):
         "The section of the text; empty string if at top level."
         return self.text.parentpath
 
+    @property
+    def is_displayed(self):
+        return self.view is not None
+
     def get_cursor(self):
         "Get the position of cursor in absolute number of characters."
+        if self.view is None:
+            return self.saved_cursor
         return super().get_cursor() - self.heading_offset
 
     def set_cursor(self, position):
         "Set the position of the cursor by the absolute number of characters."
-        super().set_cursor(position + self.heading_offset)
+        if self.view is None:
+            self.saved_cursor = position
+        else:
+            super().set_cursor(position + self.heading_offset)
 
     cursor = property(get_cursor, set_cursor)
 
     @property
     def heading(self):
-        if self.main.config["main"].get("display_heading_ordinal", False):
-            return self.text.heading
-        else:
-            return self.text.name
+        "The heading of the text; with ordinal if so set for the source."
+        return self.text.heading
 
     @property
     def heading_offset(self):
@@ -67,3 +86,73 @@ class TextViewer(Viewer):
 
     def display_view(self):
         self.render(self.text.ast)
+
+    def display(self):
+        "Display the text, first creating the view if not already done."
+        if self.view is None:
+            self.view_widget_create()
+            self.configure_tags()
+            self.bind_tags()
+            self.bind_events()
+            super().display()
+            self.cursor = self.saved_cursor
+            if self.saved_yview is not None:
+                self.view.yview_moveto(self.saved_yview)
+        else:
+            super().display()
+
+    def show(self):
+        """Display the text in the texts notebook of the main window, if not done.
+        Record it as the most recently shown text.
+        """
+        if self.view is None:
+            self.display()
+            opener = functools.partial(self.main.open_text_editor, text=self.text)
+            self.view.bind("<Double-Button-1>", opener)
+            self.view.bind("<Return>", opener)
+            self.view.bind("<Control-q>", self.main.quit)
+            self.view.bind("<Control-Q>", self.main.quit)
+        self.main.texts_viewer_shown(self.text)
+
+    def undisplay(self):
+        """Destroy the view and its contents, keeping the cursor position
+        and scroll state. The text is displayed anew when next shown.
+        """
+        if self.view is None:
+            return
+        self.saved_cursor = self.cursor
+        self.saved_yview = self.view.yview()[0]
+        self.view.destroy()
+        self.scroll_y.destroy()
+        self.view = None
+        self.graphics = {}
+
+    def redisplay(self):
+        """Display the text anew, keeping the cursor position. If the text
+        has not been displayed, this is done when it is shown.
+        """
+        if self.view is None:
+            return
+        cursor = self.cursor
+        self.display()
+        self.cursor = cursor
+
+    def highlight(self, first, last=None, tag=None):
+        "Show the text, and highlight the characters as given."
+        self.show()
+        super().highlight(first, last=last, tag=tag)
+
+    def highlight_occurrence(self, key, number, tag):
+        """Show the text, and highlight the given occurrence (starting at 1)
+        of the indexed term or reference.
+        """
+        self.show()
+        if tag == constants.INDEXED:
+            positions = self.indexed.get(key, ())
+        else:
+            positions = self.references.get(key, ())
+        try:
+            offset = sorted(positions)[number - 1]
+        except IndexError:
+            return
+        self.highlight(f"1.0+{offset}c", tag=tag)
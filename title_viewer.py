@@ -105,6 +105,4 @@ class TitleViewer(Viewer):
         self.status_var.set(Tr(str(min(statuses))))
         self.chapters_var.set(len(self.main.source.items))
         self.texts_var.set(len(self.main.source.all_texts))
-        self.characters_var.set(
-            sum([len(t.viewer) for t in self.main.source.all_texts])
-        )
+        self.characters_var.set(sum([t.length for t in self.main.source.all_texts]))
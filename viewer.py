@@ -4,6 +4,8 @@ Methods for rendering Marko AST to the tk.Text instance.
 
 from icecream import ic
 
+import bisect
+import re
 import string
 import webbrowser
 
@@ -12,11 +14,15 @@ import tkinter.messagebox
 import tkinter.ttk
 
 import constants
+import renderer
 import utils
 from graphics import Conceptmap
+from renderer import Renderer
 
 from utils import Tr
 
+NEWLINE_RX = re.compile("\n")
+
 
 class Viewer:
     """Abstract viewer class containing a tk.Text instance, defining tags and callbacks.
@@ -24,6 +30,9 @@ class Viewer:
     """
 
     TEXT_COLOR = "white"
+    # Use the same tag for all links, indexed terms, references, and
+    # list items at the same level; see 'Renderer'.
+    POOLED_TAGS = True
 
     def __init__(self, parent, main):
         self.main = main
@@ -34,14 +43,28 @@ class Viewer:
 
     def __len__(self):
         "Number of characters in the 'view' tk.Text instance."
-        return len(self.view.get("1.0", tk.END))
+        return self.count("1.0", tk.END)
+
+    def count(self, first, last):
+        """Return the number of characters from the first to the last position,
+        as counted by Tk. The contents are not copied out of Tk.
+        """
+        return (self.view.count(first, last, "indices") or (0,))[0]
 
     def view_create(self, parent):
         "Create the 'view' tk.Text instance and its associates."
+        self.view_frame_create(parent)
+        self.view_widget_create()
+
+    def view_frame_create(self, parent):
+        "Create the frame to contain the 'view' tk.Text instance."
         self.view_frame = tk.ttk.Frame(parent)
         self.view_frame.pack(fill=tk.BOTH, expand=True)
         self.view_frame.rowconfigure(0, weight=1)
         self.view_frame.columnconfigure(0, weight=1)
+
+    def view_widget_create(self):
+        "Create the 'view' tk.Text instance and its scrollbar in the frame."
         self.view = tk.Text(
             self.view_frame,
             background=self.TEXT_COLOR,
@@ -157,7 +180,8 @@ class Viewer:
         self.view.bind("<F2>", self.debug_selected)
         self.view.bind("<F3>", self.debug_clipboard)
         self.view.bind("<F4>", self.debug_dump)
-        self.view.bind("<F5>", self.debug_ast)
+        # F5 is used by the main window to refresh.
+        self.view.bind("<F6>", self.debug_ast)
 
     def display(self):
         self.display_initialize()
@@ -166,13 +190,18 @@ class Viewer:
         self.display_finalize()
 
     def display_initialize(self):
-        self.prev_line_blank = True
         self.links = {}
         self.xrefs = {}
         self.list_lookup = {}
-        self.list_stack = []
-        self.indexed = {}
-        self.references = {}
+        self.indexed = {}  # Key: canonical term; value: set of offsets.
+        self.references = {}  # Key: reference; value: set of offsets.
+        # The links, indexed terms and references as (first, last, value),
+        # since the viewer uses the same tag for all of each kind.
+        self.intervals = {
+            constants.LINK: [],
+            constants.INDEXED: [],
+            constants.REFERENCE: [],
+        }
         self.footnotes = {}
         self.highlighted = None
         self.view.delete("1.0", tk.END)
@@ -186,21 +215,8 @@ class Viewer:
         raise NotImplementedError
 
     def display_finalize(self):
-        """Get the final positions of the indexed terms and references.
-        These are affected by footnotes and can be obtained only after rendering.
-        """
-        for tag in self.view.tag_names():
-            if not tag.startswith(constants.INDEXED_PREFIX):
-                continue
-            canonical = tag[len(constants.INDEXED_PREFIX) :]
-            range = self.view.tag_nextrange(tag, "1.0")
-            while range:
-                self.indexed.setdefault(canonical, set()).add(range[0])
-                range = self.view.tag_nextrange(tag, range[0] + "+1c")
-        range = self.view.tag_nextrange(constants.REFERENCE, "1.0")
-        while range:
-            self.references.setdefault(self.view.get(*range), set()).add(range[0])
-            range = self.view.tag_nextrange(constants.REFERENCE, range[0] + "+1c")
+        "To be defined, if required."
+        pass
 
     def cursor_home(self, event=None):
         self.view.mark_set(tk.INSERT, "1.0")
@@ -212,7 +228,7 @@ class Viewer:
 
     def get_cursor(self):
         "Get the position of cursor in absolute number of characters."
-        return len(self.view.get("1.0", tk.INSERT))
+        return self.count("1.0", tk.INSERT)
 
     def set_cursor(self, position):
         "Set the position of the cursor by the absolute number of characters."
@@ -242,203 +258,104 @@ class Viewer:
         if event.char:
             return "break"
 
-    def line_break(self):
-        self.view.insert(tk.INSERT, "\n")
-        self.prev_line_blank = True
-
-    def conditional_line_break(self):
-        if self.prev_line_blank:
-            return
-        self.view.insert(tk.INSERT, "\n")
-        self.prev_line_blank = True
-
     def render(self, ast):
-        try:
-            method = getattr(self, f"render_{ast['element']}")
-        except AttributeError:
-            ic("Could not handle ast", ast)
-        else:
-            method(ast)
-
-    def render_document(self, ast):
-        self.prev_line_blank = True
-        for child in ast["children"]:
-            self.render(child)
-
-    def render_heading(self, ast):
-        "Render as ordinary text on its own line."
-        self.conditional_line_break()
-        for child in ast["children"]:
-            self.render(child)
-        self.line_break()
-
-    def render_paragraph(self, ast):
-        self.conditional_line_break()
-        if self.list_stack:
-            data = self.list_stack[-1]
-            if not data["tight"] and not data["first_paragraph"]:
-                self.line_break()
-                self.line_break()
-            data["first_paragraph"] = False
-        for child in ast["children"]:
-            self.render(child)
-        if not self.list_stack:
-            self.line_break()
-            self.line_break()
-
-    def render_emphasis(self, ast):
-        first = self.view.index(tk.INSERT)
-        for child in ast["children"]:
-            self.render(child)
-        self.view.tag_add(constants.ITALIC, first, tk.INSERT)
-
-    def render_strong_emphasis(self, ast):
-        first = self.view.index(tk.INSERT)
-        for child in ast["children"]:
-            self.render(child)
-        self.view.tag_add(constants.BOLD, first, tk.INSERT)
-
-    def render_raw_text(self, ast):
-        line = ast["children"]
-        if not type(line) == str:
-            ic("could not handle", ast)
-            return
-        if line[-1] == "\n":
-            line = line[:-1] + " "
-        self.view.insert(tk.INSERT, line)
-
-    def render_line_break(self, ast):
-        pass
-
-    def render_blank_line(self, ast):
-        pass
-
-    def render_quote(self, ast):
-        self.conditional_line_break()
-        first = self.view.index(tk.INSERT)
-        for child in ast["children"]:
-            self.render(child)
-        self.view.tag_add(constants.QUOTE, first, tk.INSERT)
-
-    def render_code_span(self, ast):
-        self.view.insert(tk.INSERT, ast["children"], constants.CODE_SPAN)
-
-    def render_code_block(self, ast):
-        self.conditional_line_break()
-        first = self.view.index(tk.INSERT)
-        for child in ast["children"]:
-            self.render(child)
-        self.view.tag_add(constants.CODE_BLOCK, first, tk.INSERT)
-        self.line_break()
-        self.line_break()
-
-    def render_fenced_code(self, ast):
-        self.conditional_line_break()
-        if ast["lang"] == constants.CONCEPTMAP:
-            graphic = Conceptmap(self, ast["children"][0]["children"])
-            self.graphics[str(graphic.canvas_frame)] = graphic
-        else:
-            first = self.view.index(tk.INSERT)
-            for child in ast["children"]:
-                self.render(child)
-            self.view.tag_add(constants.FENCED_CODE, first, tk.INSERT)
-        self.line_break()
-        self.line_break()
-
-    def render_literal(self, ast):
-        self.view.insert(tk.INSERT, ast["children"])
-
-    def render_thematic_break(self, ast):
-        self.conditional_line_break()
-        self.view.insert(tk.INSERT, constants.EM_DASH * 20, constants.THEMATIC_BREAK)
-        self.line_break()
-        self.line_break()
-
-    def render_link(self, ast):
-        first = self.view.index(tk.INSERT)
-        for child in ast["children"]:
-            self.render(child)
-        self.link_create(ast["dest"], ast["title"], first, self.view.index(tk.INSERT))
-
-    def render_list(self, ast):
-        # Begin list on a new line.
-        level = len(self.list_stack)
-        if level > 0:
-            self.view.insert(tk.INSERT, "\n")
-            if not self.list_stack[-1]["tight"]:
-                self.view.insert(tk.INSERT, "\n")
-
-        # The number and tags of the list.
-        number = len(self.list_lookup) + 1
-        list_tag = f"{constants.LIST_PREFIX}{number}"
-        item_tag_prefix = f"{constants.LIST_ITEM_PREFIX}{number}-"
-        bullet_tag = f"{constants.LIST_BULLET_PREFIX}{number}"
-        self.view.tag_configure(
-            bullet_tag,
-            font=constants.FONT_BOLD,
-            lmargin1=constants.LIST_INDENT * level,
+        """Render the AST into the view at the current position.
+        Record the positions of indexed terms and references as offsets
+        from the start of the view.
+        """
+        base = self.count("1.0", tk.INSERT)
+        rendered = Renderer(
+            self.links,
+            self.list_lookup,
+            self.footnotes,
+            astral=self.view.tk.call("string", "length", "\U0001f600") == 2,
+            pooled=self.POOLED_TAGS,
         )
-
-        # The data for this list.
-        data = dict(
-            number=number,
-            list_tag=list_tag,
-            item_tag_prefix=item_tag_prefix,
-            bullet_tag=bullet_tag,
-            ordered=ast["ordered"],
-            bullet=ast["bullet"],
-            start=ast["start"],
-            tight=ast["tight"],
-            count=0,
-            level=level,
+        rendered.render(ast)
+        rendered.report_unknown()
+        self.apply(rendered)
+        for first, last, tag, value in rendered.intervals:
+            self.intervals[tag].append((base + first, base + last, value))
+            if tag == constants.INDEXED:
+                self.indexed.setdefault(value, set()).add(base + first)
+            elif tag == constants.REFERENCE:
+                self.references.setdefault(value, set()).add(base + first)
+        for intervals in self.intervals.values():
+            intervals.sort(key=lambda i: i[0])
+
+    def apply(self, rendered):
+        """Apply the streams of operations produced by the renderer to the view.
+        Consecutive insertions in the main stream are done in one call to Tk.
+        The insertions for a footnote definition are done one by one, since
+        those without tags must inherit the tags surrounding its reference.
+        """
+        start = self.view.index(tk.INSERT)
+        for offset, ops in rendered.streams:
+            if offset is None:
+                index = self.get_index_converter(start, ops, rendered.astral)
+            else:
+                self.view.mark_set(tk.INSERT, f"{start}+{offset}c")
+                base = self.view.index(tk.INSERT)
+                index = self.get_index_converter(base, ops, rendered.astral)
+            batch = []
+            for op in ops:
+                if op[0] == renderer.INSERT:
+                    if offset is not None:
+                        if op[2] is None:
+                            self.view.insert(tk.INSERT, op[1])
+                        else:
+                            self.view.insert(tk.INSERT, op[1], op[2])
+                        continue
+                    batch.append(op[1])
+                    batch.append(op[2] or ())
+                    if len(batch) < 2 * constants.RENDER_BATCH_SIZE:
+                        continue
+                if batch:
+                    self.view.insert(tk.INSERT, *batch)
+                    batch = []
+                if op[0] == renderer.TAG_ADD:
+                    self.view.tag_add(op[1], index(op[2]), index(op[3]))
+                elif op[0] == renderer.CONFIGURE:
+                    self.view.tag_configure(op[1], **op[2])
+                elif op[0] == renderer.WINDOW:
+                    graphic = Conceptmap(self, op[1])
+                    self.graphics[str(graphic.canvas_frame)] = graphic
+                elif op[0] == renderer.ELIDE:
+                    self.tag_elide(op[1])
+                elif op[0] == renderer.DELETE_LAST:
+                    self.view.delete(tk.INSERT + "-1c")
+            if batch:
+                self.view.insert(tk.INSERT, *batch)
+        # Continue after the main stream.
+        if len(rendered.streams) > 1:
+            self.view.mark_set(tk.INSERT, tk.END)
+
+    def get_index_converter(self, base, ops, astral):
+        """Return a function converting a character offset within the stream
+        of operations to a Tk 'line.column' index, given the index of its start.
+        If 'astral' is true, Tk counts a character outside the Basic
+        Multilingual Plane as two.
+        """
+        chars = "".join(
+            [
+                op[1] if op[0] == renderer.INSERT else " "
+                for op in ops
+                if op[0] in (renderer.INSERT, renderer.WINDOW)
+            ]
         )
-        self.list_lookup[list_tag] = data
-        self.list_stack.append(data)
-
-        # Remember where this list starts.
-        first = self.view.index(tk.INSERT)
-
-        # Render children, i.e. list items.
-        for child in ast["children"]:
-            self.prev_line_blank = True
-            self.render(child)
-
-        # Set the overall tag for this list.
-        self.view.tag_add(list_tag, first, tk.INSERT)
-        if level == 0:
-            self.line_break()
-        self.list_stack.pop()
-        if self.list_stack:
-            self.list_stack[-1]["previous_was_list"] = True
-
-    def render_list_item(self, ast):
-        data = self.list_stack[-1]
-        data["count"] += 1
-        data["first_paragraph"] = True
-
-        # Add bullet for item.
-        if data["ordered"]:
-            bullet = f"{data['start'] + data['count'] - 1}. "
-        else:
-            bullet = f"{data['bullet']}  "
-        self.view.insert(tk.INSERT, bullet, data["bullet_tag"])
-
-        # Create item tag and output item content.
-        item_tag = f"{data['item_tag_prefix']}{data['count']}"
-        self.list_lookup[item_tag] = data
-        indent = constants.LIST_INDENT * (data["level"] + 1)
-        self.view.tag_configure(item_tag, lmargin1=indent, lmargin2=indent)
-        first = self.view.index(tk.INSERT)
-        for child in ast["children"]:
-            self.render(child)
-        if self.list_stack:
-            if self.list_stack[-1].get("previous_was_list"):
-                self.list_stack[-1]["previous_was_list"] = False
+        if astral:
+            chars = renderer.ASTRAL_RX.sub("  ", chars)
+        line, column = [int(i) for i in base.split(".")]
+        newlines = [m.start() for m in NEWLINE_RX.finditer(chars)]
+
+        def index(offset):
+            count = bisect.bisect_left(newlines, offset)
+            if count:
+                return f"{line + count}.{offset - newlines[count - 1] - 1}"
             else:
-                self.view.insert(tk.INSERT, "\n")
-        if not data["tight"]:
-            self.view.insert(tk.INSERT, "\n")
-        self.view.tag_add(item_tag, first, tk.INSERT)
+                return f"{line}.{column + offset}"
+
+        return index
 
     def get_list_item_tag(self):
         result = []
@@ -451,37 +368,6 @@ class Viewer:
         else:
             return None
 
-    def render_indexed(self, ast):
-        # Position at this time is not useful; will be affected by footnotes.
-        tag = constants.INDEXED_PREFIX + ast["canonical"]
-        self.view.insert(tk.INSERT, ast["term"], (constants.INDEXED, tag))
-
-    def render_reference(self, ast):
-        # Position at this time is not useful; will be affected by footnotes.
-        tag = (constants.REFERENCE_PREFIX + ast["reference"]).replace(" ", "_")
-        self.view.insert(tk.INSERT, ast["reference"], (constants.REFERENCE, tag))
-
-    def render_footnote_ref(self, ast):
-        label = ast["label"]
-        tag = constants.FOOTNOTE_REF_PREFIX + label
-        self.footnotes[label] = dict(label=label, tag=tag)
-        self.view.insert(tk.INSERT, f"^{label}", (constants.FOOTNOTE_REF, tag))
-
-    def render_footnote_def(self, ast):
-        tag = self.footnotes[ast["label"]]["tag"]
-        first = self.view.tag_nextrange(tag, "1.0")[1]
-        self.view.mark_set(tk.INSERT, first)
-        self.view.insert(tk.INSERT, "\n")  # For nicer appearance; do not save.
-        for child in ast["children"]:
-            self.render(child)
-        # Remove newline from last paragraph in footnote def, for nicer appearance.
-        if self.view.get(tk.INSERT + "-1c") == "\n":
-            self.view.delete(tk.INSERT + "-1c")
-        self.view.tag_add(constants.FOOTNOTE_DEF, first + "+1c", tk.INSERT)
-        tag = constants.FOOTNOTE_DEF_PREFIX + ast["label"]
-        self.tag_elide(tag)
-        self.view.tag_add(tag, first, tk.INSERT)
-
     def highlight(self, first, last=None, tag=None):
         "Highlight the characters marked by the tag starting at the given position."
         self.view.focus_set()
@@ -518,7 +404,10 @@ class Viewer:
         webbrowser.open_new_tab(link["url"])
 
     def get_link(self, tag=None):
+        "Get the link at the current position, or the one for the given tag."
         if tag is None:
+            if self.POOLED_TAGS:
+                return self.get_interval(constants.LINK)
             for tag in self.view.tag_names(tk.CURRENT):
                 if tag.startswith(constants.LINK_PREFIX):
                     break
@@ -526,10 +415,24 @@ class Viewer:
                 return None
         return self.links.get(tag)
 
-    def xref_create(self, fullname, position, target_tag, label=None):
+    def get_interval(self, tag, index=tk.CURRENT):
+        "Get the value of the interval for the tag at the position, if any."
+        offset = self.count("1.0", index)
+        intervals = self.intervals[tag]
+        pos = bisect.bisect_right(intervals, offset, key=lambda i: i[0]) - 1
+        if pos >= 0 and offset < intervals[pos][1]:
+            return intervals[pos][2]
+        return None
+
+    def xref_create(self, fullname, key, number, target_tag, label=None):
+        """Create a link to the given occurrence (starting at 1) of the indexed
+        term or reference in the text.
+        """
         tag = f"{constants.XREF_PREFIX}{len(self.xrefs) + 1}"
         self.view.insert(tk.INSERT, label or fullname, (constants.XREF, tag))
-        self.xrefs[tag] = dict(tag=target_tag, fullname=fullname, position=position)
+        self.xrefs[tag] = dict(
+            tag=target_tag, fullname=fullname, key=key, number=number
+        )
 
     def xref_enter(self, event):
         xref = self.get_xref()
@@ -547,7 +450,7 @@ class Viewer:
         text = self.main.source[xref["fullname"]]
         assert text.is_text
         self.main.texts_notebook.select(text.tabid)
-        text.viewer.highlight(xref["position"], tag=xref["tag"])
+        text.viewer.highlight_occurrence(xref["key"], xref["number"], xref["tag"])
 
     def get_xref(self, tag=None):
         if tag is None:
@@ -571,6 +474,8 @@ class Viewer:
 
     def get_indexed(self):
         "Get the canonical indexed term at the current position."
+        if self.POOLED_TAGS:
+            return self.get_interval(constants.INDEXED)
         for tag in self.view.tag_names(tk.CURRENT):
             if tag.startswith(constants.INDEXED_PREFIX):
                 return tag[len(constants.INDEXED_PREFIX) :]
@@ -587,6 +492,9 @@ class Viewer:
             self.main.references_viewer.highlight(reference)
 
     def get_reference(self):
+        "Get the reference at the current position."
+        if self.POOLED_TAGS:
+            return self.get_interval(constants.REFERENCE)
         for tag in self.view.tag_names(tk.CURRENT):
             if tag.startswith(constants.REFERENCE_PREFIX):
                 return tag[len(constants.REFERENCE_PREFIX) :].replace("_", " ")
@@ -699,35 +607,97 @@ class Viewer:
     def get_dump(self, first, last):
         """Get the dump of the 'view' tk.Text contents from first to last.
         Cleanup and preprocess the entries.
+        With pooled tags, adjacent elements of a kind share one range of
+        their tag, so the entries for each element are made from the table
+        of intervals instead, and the contents are dumped in segments between
+        the elements' boundaries, where these entries are inserted.
         """
-        entries = self.view.dump(first, last)
+        segments = self.get_dump_segments(first, last)
+        entries = []
+        for number, (offset, ends, starts) in enumerate(segments[:-1]):
+            end = self.view.index(f"1.0+{segments[number + 1][0]}c")
+            for entry in self.view.dump(f"1.0+{offset}c", end):
+                if self.POOLED_TAGS and entry[1] in self.intervals:
+                    continue
+                # Entries at the end of a segment are also at the start of the next.
+                if number < len(segments) - 2 and entry[0] != "text":
+                    if entry[2] == end:
+                        continue
+                entries.append((number, entry))
         # Get rid of starting tagoff entries.
-        while entries and entries[0][0] == "tagoff":
+        while entries and entries[0][1][0] == "tagoff":
             entries = entries[1:]
         # Get rid of ending tagon entries.
-        while entries and entries[-1][0] == "tagon":
+        while entries and entries[-1][1][0] == "tagon":
             entries = entries[:-1]
         # Get rid of irrelevant marks.
         entries = [
-            e
-            for e in entries
+            (n, e)
+            for n, e in entries
             if not (
                 e[0] == "mark"
                 and (e[1] in (tk.INSERT, tk.CURRENT) or e[1].startswith("tk::"))
             )
         ]
         # Get rid of tagon SEL.
-        entries = [e for e in entries if not (e[0] == "tagon" and e[1] == tk.SEL)]
+        entries = [
+            (n, e) for n, e in entries if not (e[0] == "tagon" and e[1] == tk.SEL)
+        ]
         # Get link data to make a copy. Skip the position; not relevant.
         result = []
-        for kind, value, pos in entries:
-            if kind == "tagoff" and value.startswith(constants.LINK_PREFIX):
+        current = -1
+        for number, (kind, value, pos) in entries + [(len(segments) - 1, (None,) * 3)]:
+            while current < number:
+                current += 1
+                offset, ends, starts = segments[current]
+                for tag, item in ends:
+                    self.add_dump_element(result, "tagoff", tag, item)
+                for tag, item in starts:
+                    self.add_dump_element(result, "tagon", tag, item)
+            if kind is None:
+                pass
+            elif kind == "tagoff" and value.startswith(constants.LINK_PREFIX):
                 link = self.get_link(value)
                 result.append((kind, value, link["url"], link["title"]))
             else:
                 result.append((kind, value))
         return result
 
+    def get_dump_segments(self, first, last):
+        """Return the list of (offset, ends, starts) for the boundaries from
+        first to last of the elements with pooled tags, where 'ends' and 'starts'
+        are the lists of (tag, value) for the elements ending and starting there.
+        An element only partly within first to last has no start or end.
+        """
+        first = self.count("1.0", first)
+        last = self.count("1.0", last)
+        boundaries = {first: ([], []), last: ([], [])}
+        if self.POOLED_TAGS:
+            for tag, intervals in self.intervals.items():
+                pos = bisect.bisect_right(intervals, first, key=lambda i: i[0]) - 1
+                for start, end, value in intervals[max(pos, 0) :]:
+                    if start >= last:
+                        break
+                    if first <= start:
+                        boundaries.setdefault(start, ([], []))[1].append((tag, value))
+                    if first < end <= last:
+                        boundaries.setdefault(end, ([], []))[0].append((tag, value))
+        return [(o, *boundaries[o]) for o in sorted(boundaries)]
+
+    def add_dump_element(self, result, kind, tag, item):
+        "Add the dump entries for the start or end of an element with a pooled tag."
+        result.append((kind, tag))
+        # Add the tag of the element itself, as used by the editor.
+        if tag == constants.LINK:
+            if kind == "tagon":
+                result.append((kind, item["tag"]))
+            else:
+                result.append((kind, item["tag"], item["url"], item["title"]))
+        elif tag == constants.INDEXED:
+            result.append((kind, constants.INDEXED_PREFIX + item))
+        elif tag == constants.REFERENCE:
+            result.append((kind, (constants.REFERENCE_PREFIX + item).replace(" ", "_")))
+
     def debug_tags(self, event=None):
         ic(
             "--- tk.INSERT ---",
@@ -755,4 +725,7 @@ class Viewer:
         ic(self.view.dump("1.0", tk.END))
 
     def debug_ast(self, event=None):
-        ic(self.text.ast)
+        try:
+            ic(self.text.ast)
+        except AttributeError:  # This viewer does not show a text.
+            pass
@@ -0,0 +1,105 @@
+"Base class for rendering the AST of a Markdown text, by dispatch on the element."
+
+from icecream import ic
+
+import time
+
+PREFIX = "render_"
+
+
+class Visitor:
+    """Base class for rendering the AST of a Markdown text.
+    The node of each element is handled by the method 'render_<element>'.
+    The table of these methods is built once for each subclass.
+    The number of nodes of elements lacking a method are counted per class,
+    and output by 'report_unknown'.
+    """
+
+    dispatch = {}
+    unknown = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.dispatch = dict(
+            [
+                (name[len(PREFIX) :], getattr(cls, name))
+                for name in dir(cls)
+                if name.startswith(PREFIX) and name != "render_children"
+            ]
+        )
+        cls.unknown = {}
+
+    def render(self, ast):
+        "Render the node by the method for its element."
+        try:
+            method = self.dispatch[ast.element]
+        except KeyError:
+            self.unknown[ast.element] = self.unknown.get(ast.element, 0) + 1
+        else:
+            method(self, ast)
+
+    def render_children(self, ast):
+        "Render the children of the node."
+        dispatch = self.dispatch
+        for child in ast.children:
+            try:
+                method = dispatch[child.element]
+            except KeyError:
+                self.unknown[child.element] = self.unknown.get(child.element, 0) + 1
+            else:
+                method(self, child)
+
+    def report_unknown(self):
+        "Output and reset the counts of the elements that could not be handled."
+        if self.unknown:
+            ic("Could not handle", type(self).__name__, self.unknown)
+            self.unknown.clear()
+
+
+def benchmark(ast, number=100):
+    """Output the time per node for rendering the AST by the dispatch table,
+    compared to looking up the method by name for each node.
+    """
+
+    class Lookup:
+        def render(self, ast):
+            try:
+                method = getattr(self, f"render_{ast['element']}")
+            except AttributeError:
+                ic("Could not handle ast", ast)
+            else:
+                method(ast)
+
+        def render_node(self, ast):
+            if isinstance(ast.children, tuple):
+                for child in ast.children:
+                    self.render(child)
+
+    class Dispatch(Visitor):
+        def render_node(self, ast):
+            if isinstance(ast.children, tuple):
+                self.render_children(ast)
+
+    # Make all nodes of the same element, to measure only the dispatch.
+    def relabel(node):
+        if isinstance(node.children, tuple):
+            children = tuple([relabel(c) for c in node.children])
+        else:
+            children = node.children
+        return type(node)("node", children, node.attrs)
+
+    ast = relabel(ast)
+    nodes = 0
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        if isinstance(node.children, tuple):
+            stack.extend(node.children)
+    for cls in (Lookup, Dispatch):
+        visitor = cls()
+        start = time.perf_counter()
+        for i in range(number):
+            visitor.render(ast)
+        elapsed = time.perf_counter() - start
+        ic(cls.__name__, f"{1e9 * elapsed / (number * nodes):.0f} ns per node")
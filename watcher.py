@@ -0,0 +1,67 @@
+"Background watcher for changes to the files of a source made by other programs."
+
+from icecream import ic
+
+import os
+import queue
+import threading
+
+import constants
+
+
+class Watcher(threading.Thread):
+    """Poll the modification times and sizes of the Markdown files in
+    the directory tree in a background thread. Whenever anything has changed,
+    put the directory path in the queue.
+    Tk must be used only from its own thread, so the Tk main loop is expected
+    to poll the queue, and do the actual work.
+    """
+
+    def __init__(self, absdirpath, skip=(), interval=constants.WATCH_INTERVAL):
+        super().__init__(daemon=True)
+        self.absdirpath = absdirpath
+        self.skip = set(skip)
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+
+    def run(self):
+        previous = self.snapshot()
+        while not self.stopped.wait(self.interval):
+            current = self.snapshot()
+            if current != previous:
+                self.queue.put(self.absdirpath)
+                previous = current
+
+    def stop(self):
+        self.stopped.set()
+
+    def changed(self):
+        "Has any change been reported since the last call? Does not block."
+        result = False
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return result
+            result = True
+
+    def snapshot(self):
+        "Return the modification time and size of all Markdown files."
+        result = {}
+        stack = [self.absdirpath]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                with os.scandir(dirpath) as scanner:
+                    for entry in scanner:
+                        if dirpath == self.absdirpath and entry.name in self.skip:
+                            continue
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.name.endswith(constants.MARKDOWN_EXT):
+                            stat = entry.stat()
+                            result[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:  # Removed while being scanned; caught next time.
+                pass
+        return result